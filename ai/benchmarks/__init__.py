@@ -0,0 +1,12 @@
+"""
+Benchmarks for the AI service entry points.
+
+Generates a synthetic catalog and interaction history into a SQLite
+stand-in for MySQL, runs the entry points against an embedded Qdrant (or a
+local Qdrant server) and writes latency, throughput, DB round trips and
+peak RSS as JSON.
+
+Run from the ai/ directory:
+    python -m benchmarks.run --products 10000 --output bench.json
+    python -m benchmarks.compare old.json new.json
+"""
@@ -0,0 +1,142 @@
+# benchmarks/catalog.py
+"""
+Synthetic catalog and interaction history.
+
+Product popularity and user activity are both Zipf-skewed, so a few
+products and users account for most interactions, as in real traffic.
+Tags are drawn mostly from a per-category pool so that category and tag
+boosts have something to find.
+"""
+import json
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+WORDS = (
+    "alpha bright classic compact deluxe eco essential fresh giant handy ideal light modern natural "
+    "portable premium pro quick rugged smart soft solid sturdy tiny ultra vintage warm wireless zen"
+).split()
+NOUNS = (
+    "bag blender book bottle camera chair charger desk drill headphones jacket kettle lamp mat mug "
+    "notebook pan pen phone puzzle racket scarf shoe speaker tent toy trowel vase watch"
+).split()
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+TAGS_PER_CATEGORY = 12
+TAG_VOCABULARY = 600
+
+
+@dataclass
+class CatalogConfig:
+    products: int = 10000
+    users: int = 2000
+    categories: int = 0             # 0 = derived from the number of products
+    interactions_per_user: float = 20.0
+    purchase_ratio: float = 0.15    # share of interactions that are purchases
+    popularity_skew: float = 1.1    # Zipf exponent for product popularity
+    activity_skew: float = 1.3      # Zipf exponent for user activity
+    seed: int = 42
+
+    @property
+    def category_count(self) -> int:
+        return self.categories or int(min(200, max(10, self.products // 1000)))
+
+
+def categories(config: CatalogConfig) -> List[Tuple]:
+    now = datetime(2025, 1, 1).strftime(TIMESTAMP_FORMAT)
+    return [
+        (cid, f"Category {cid}", f"category-{cid}", f"Synthetic category {cid}", now, now)
+        for cid in range(1, config.category_count + 1)
+    ]
+
+
+def products(config: CatalogConfig, chunk_size: int = 10000) -> Iterator[List[Tuple]]:
+    """Yield product rows in chunks (id, name, description, category_id, tags, price, image_url, ...)."""
+    rng = np.random.default_rng(config.seed)
+    n_categories = config.category_count
+    category_tags = rng.integers(0, TAG_VOCABULARY, size=(n_categories, TAGS_PER_CATEGORY))
+    now = datetime(2025, 1, 1).strftime(TIMESTAMP_FORMAT)
+
+    for start in range(0, config.products, chunk_size):
+        stop = min(start + chunk_size, config.products)
+        size = stop - start
+        category_ids = rng.integers(1, n_categories + 1, size=size)
+        adjectives = rng.integers(0, len(WORDS), size=(size, 3))
+        nouns = rng.integers(0, len(NOUNS), size=size)
+        tag_counts = rng.integers(1, 5, size=size)
+        prices = np.round(rng.uniform(2, 500, size=size), 2)
+
+        rows = []
+        for i in range(size):
+            pid = start + i + 1
+            cat = int(category_ids[i])
+            # Mostly category tags, sometimes a random one
+            tags = {
+                f"tag{int(t)}"
+                for t in rng.choice(category_tags[cat - 1], size=tag_counts[i], replace=False)
+            }
+            if rng.random() < 0.2:
+                tags.add(f"tag{int(rng.integers(0, TAG_VOCABULARY))}")
+            words = [WORDS[j] for j in adjectives[i]]
+            name = f"{words[0].title()} {NOUNS[nouns[i]]} {pid}"
+            description = f"A {words[1]} and {words[2]} {NOUNS[nouns[i]]} for everyday use."
+            rows.append((
+                pid, name, description, cat, json.dumps(sorted(tags)), float(prices[i]),
+                f"https://example.com/images/{pid}.jpg", now, now
+            ))
+        yield rows
+
+
+def _zipf_weights(n: int, skew: float, rng) -> np.ndarray:
+    ranks = np.arange(1, n + 1, dtype=np.float64)
+    weights = ranks ** -skew
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def user_activity_counts(config: CatalogConfig) -> np.ndarray:
+    """Interactions per user (Zipf-skewed, averaging interactions_per_user)."""
+    rng = np.random.default_rng(config.seed + 1)
+    weights = _zipf_weights(config.users, config.activity_skew, rng)
+    total = int(config.users * config.interactions_per_user)
+    return rng.multinomial(total, weights)
+
+
+def interactions(config: CatalogConfig, chunk_size: int = 50000) -> Iterator[Tuple[str, List[Tuple]]]:
+    """
+    Yield ("visited_products" | "purchased_products", rows) chunks of
+    (user_id, product_id, occurred_at, created_at, updated_at).
+    """
+    rng = np.random.default_rng(config.seed + 2)
+    # Sample products by inverse CDF (rng.choice with p= recomputes it per call)
+    popularity_cdf = np.cumsum(_zipf_weights(config.products, config.popularity_skew, rng))
+    counts = user_activity_counts(config)
+    start_time = datetime(2025, 1, 1)
+
+    views, purchases = [], []
+    for user_index, count in enumerate(counts):
+        if count == 0:
+            continue
+        user_id = user_index + 1
+        product_ids = np.minimum(
+            np.searchsorted(popularity_cdf, rng.random(count), side="right"), config.products - 1
+        ) + 1
+        offsets = np.sort(rng.integers(0, 180 * 24 * 3600, size=count))
+        is_purchase = rng.random(count) < config.purchase_ratio
+        for pid, offset, purchase in zip(product_ids, offsets, is_purchase):
+            at = (start_time + timedelta(seconds=int(offset))).strftime(TIMESTAMP_FORMAT)
+            (purchases if purchase else views).append((user_id, int(pid), at, at, at))
+
+        if len(views) >= chunk_size:
+            yield "visited_products", views
+            views = []
+        if len(purchases) >= chunk_size:
+            yield "purchased_products", purchases
+            purchases = []
+
+    if views:
+        yield "visited_products", views
+    if purchases:
+        yield "purchased_products", purchases
@@ -0,0 +1,55 @@
+# benchmarks/compare.py
+"""
+Compare two benchmark reports.
+
+    python -m benchmarks.compare base.json new.json
+"""
+import json
+import sys
+
+METRICS = [
+    ("p50_ms", "lower"),
+    ("p95_ms", "lower"),
+    ("p99_ms", "lower"),
+    ("throughput_per_sec", "higher"),
+    ("db_round_trips_per_call", "lower"),
+    ("peak_rss_mb", "lower"),
+]
+
+
+def compare(base: dict, new: dict) -> list:
+    """Rows of (entry, metric, base value, new value, relative change, better?)."""
+    rows = []
+    for entry, new_stats in new["results"].items():
+        base_stats = base["results"].get(entry)
+        if base_stats is None:
+            continue
+        for metric, better in METRICS:
+            old, cur = base_stats.get(metric), new_stats.get(metric)
+            if old is None or cur is None:
+                continue
+            change = (cur - old) / old if old else 0.0
+            improved = change < 0 if better == "lower" else change > 0
+            rows.append((entry, metric, old, cur, change, improved))
+    return rows
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print("Usage: python -m benchmarks.compare base.json new.json")
+        sys.exit(2)
+    with open(argv[0]) as f:
+        base = json.load(f)
+    with open(argv[1]) as f:
+        new = json.load(f)
+
+    print(f"base: {base['meta'].get('commit', '')[:10]}  new: {new['meta'].get('commit', '')[:10]}")
+    print(f"{'entry point':<24} {'metric':<26} {'base':>12} {'new':>12} {'change':>9}")
+    for entry, metric, old, cur, change, improved in compare(base, new):
+        marker = "" if abs(change) < 0.05 else (" ✅" if improved else " ⚠️")
+        print(f"{entry:<24} {metric:<26} {old:>12.2f} {cur:>12.2f} {change:>+8.1%}{marker}")
+
+
+if __name__ == "__main__":
+    main()
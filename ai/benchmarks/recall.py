@@ -0,0 +1,148 @@
+# benchmarks/recall.py
+"""
+Measure search recall against latency for HNSW / quantization settings.
+
+    cd ai
+    python -m benchmarks.recall --ef 16 32 64 128 256 --oversampling 1 2 4
+
+Query vectors are stored product vectors sampled from the serving
+collection. Ground truth is an exact search on the original float32
+vectors (quantization ignored); every setting is scored as recall@k
+against it, excluding the query product itself as product
+recommendations do. Run it against a Qdrant server (--qdrant URL):
+the embedded client (--path) always searches exactly, so it is only
+useful as a smoke test.
+"""
+import argparse
+import json
+import sys
+import time
+from itertools import product as grid
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http import models as qmodels
+
+from search_backend import COLLECTION_NAME, QDRANT_URL, search_params
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--qdrant", default=QDRANT_URL, help="Qdrant server URL")
+    parser.add_argument("--path", help="embedded on-disk Qdrant instead (e.g. a benchmark workdir's qdrant/)")
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--ef", type=int, nargs="+", default=[16, 32, 64, 128, 256], help="hnsw_ef values")
+    parser.add_argument("--rescore", choices=["on", "off", "both"], default="both")
+    parser.add_argument("--oversampling", type=float, nargs="+", default=[1.0, 2.0])
+    parser.add_argument("--category-filter", action="store_true",
+                        help="restrict each search to the query product's category")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="also write the results as JSON")
+    return parser.parse_args(argv)
+
+
+def sample_queries(client: QdrantClient, collection: str, n: int, seed: int) -> list:
+    """(product id, vector, category id) for n random points of the collection."""
+    ids, offset = [], None
+    while True:
+        records, offset = client.scroll(
+            collection_name=collection, limit=10000, offset=offset, with_payload=False, with_vectors=False
+        )
+        ids.extend(int(r.id) for r in records)
+        if offset is None:
+            break
+    if not ids:
+        raise RuntimeError(f"Collection '{collection}' is empty; run a sync first")
+
+    rng = np.random.default_rng(seed)
+    chosen = rng.choice(ids, size=min(n, len(ids)), replace=False)
+    points = client.retrieve(
+        collection_name=collection, ids=[int(pid) for pid in chosen], with_payload=["category_id"], with_vectors=True
+    )
+    return [(int(p.id), p.vector, (p.payload or {}).get("category_id")) for p in points]
+
+
+def search_ids(client: QdrantClient, collection: str, query: tuple, k: int, params: qmodels.SearchParams,
+               category_filter: bool) -> list:
+    pid, vector, category_id = query
+    query_filter = qmodels.Filter(
+        must=[qmodels.FieldCondition(key="category_id", match=qmodels.MatchValue(value=category_id))]
+    ) if category_filter and category_id is not None else None
+    hits = client.search(
+        collection_name=collection,
+        query_vector=vector,
+        query_filter=query_filter,
+        limit=k + 1,
+        with_payload=False,
+        search_params=params
+    )
+    return [int(h.id) for h in hits if int(h.id) != pid][:k]
+
+
+def measure(client, collection: str, queries: list, k: int, params, category_filter: bool, truth=None):
+    """Latencies and result ids per query, plus mean recall@k against truth."""
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        ids = search_ids(client, collection, query, k, params, category_filter)
+        latencies.append(time.perf_counter() - start)
+        results.append(ids)
+
+    ms = np.array(latencies) * 1000
+    row = {
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "mean_ms": float(ms.mean()),
+    }
+    if truth is not None:
+        recalls = [
+            len(set(ids) & set(expected)) / len(expected)
+            for ids, expected in zip(results, truth) if expected
+        ]
+        row["recall"] = float(np.mean(recalls)) if recalls else 1.0
+    return row, results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    client = QdrantClient(path=args.path) if args.path else QdrantClient(url=args.qdrant)
+
+    queries = sample_queries(client, args.collection, args.queries, args.seed)
+    print(f"{len(queries)} queries, recall@{args.k}", file=sys.stderr)
+
+    # Warm up caches / page in the index before timing anything
+    for query in queries[:20]:
+        search_ids(client, args.collection, query, args.k, search_params(), args.category_filter)
+
+    exact = qmodels.SearchParams(exact=True, quantization=qmodels.QuantizationSearchParams(ignore=True))
+    exact_row, truth = measure(client, args.collection, queries, args.k, exact, args.category_filter)
+    rows = [{"hnsw_ef": None, "rescore": None, "oversampling": None, **exact_row, "recall": 1.0}]
+
+    rescore_values = {"on": [True], "off": [False], "both": [True, False]}[args.rescore]
+    for ef, rescore, oversampling in grid(args.ef, rescore_values, args.oversampling):
+        if not rescore and oversampling != args.oversampling[0]:
+            continue  # oversampling only matters when rescoring
+        params = search_params(hnsw_ef=ef, rescore=rescore, oversampling=oversampling)
+        row, _ = measure(client, args.collection, queries, args.k, params, args.category_filter, truth)
+        rows.append({"hnsw_ef": ef, "rescore": rescore, "oversampling": oversampling if rescore else None, **row})
+
+    print(f"{'hnsw_ef':>8} {'rescore':>8} {'oversample':>10} {'recall':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for row in rows:
+        if row["hnsw_ef"] is None:
+            label = f"{'exact':>8} {'':>8} {'':>10}"
+        else:
+            oversampling = f"{row['oversampling']:g}" if row["oversampling"] else "-"
+            label = f"{row['hnsw_ef']:>8} {'on' if row['rescore'] else 'off':>8} {oversampling:>10}"
+        print(f"{label} {row['recall']:>8.4f} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": rows}, f, indent=2)
+            f.write("\n")
+        print(f"✅ Wrote {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+# benchmarks/run.py
+"""
+Benchmark the AI service entry points on a synthetic catalog.
+
+    cd ai
+    python -m benchmarks.run --products 10000 --users 2000 --output bench.json
+
+Every entry point runs in its own child process, so peak RSS is measured
+per entry point. The children share one working directory: the SQLite
+stand-in for MySQL, an embedded on-disk Qdrant (or --qdrant URL for a local
+Qdrant server; use a scratch instance, the benchmark rebuilds the
+"products" alias) and the vector store / profile / cache files.
+
+By default texts are embedded with a deterministic hash "model" so the
+numbers measure the pipeline rather than the transformer; pass
+--embedder model to use the configured embedding backend. With
+--search-backend local, sync fills only the vector store and searches run
+in process (no Qdrant at all).
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import resource
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks import catalog, sqlite_db
+
+AI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULT_MARKER = "BENCHMARK_RESULT "
+
+ENTRY_POINTS = [
+    "sync_full",
+    "recommend_for_product",
+    "recommend_for_user",
+    "recommend_for_users",
+    "sync_incremental",
+    "train_model",
+]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--categories", type=int, default=0, help="0 = one per 1000 products (10-200)")
+    parser.add_argument("--interactions-per-user", type=float, default=20.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--requests", type=int, default=200, help="measured calls per recommend entry point")
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured calls before each recommend entry point")
+    parser.add_argument("--concurrency", type=int, default=1, help="threads issuing recommend calls")
+    parser.add_argument("--batch-size", type=int, default=32, help="users per recommend_for_users call")
+    parser.add_argument("--touch-fraction", type=float, default=0.01,
+                        help="share of products changed before sync_incremental")
+    parser.add_argument("--qdrant", default="local", help="'local' (embedded, on disk) or a Qdrant server URL")
+    parser.add_argument("--search-backend", choices=["qdrant", "local"], default="qdrant",
+                        help="search backend of the recommend module (local = in-process index)")
+    parser.add_argument("--embedder", choices=["hash", "model"], default="hash")
+    parser.add_argument("--entry", action="append", choices=ENTRY_POINTS,
+                        help="entry point to run (repeatable; default all, in order)")
+    parser.add_argument("--workdir", help="keep data here instead of a temporary directory")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--child", choices=ENTRY_POINTS, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def catalog_config(args) -> catalog.CatalogConfig:
+    return catalog.CatalogConfig(
+        products=args.products,
+        users=args.users,
+        categories=args.categories,
+        interactions_per_user=args.interactions_per_user,
+        seed=args.seed,
+    )
+
+
+def data_env(workdir: str) -> dict:
+    """Environment pointing every on-disk store of the ai package into workdir."""
+    return {
+        "VECTOR_STORE_DIR": os.path.join(workdir, "product_vectors"),
+        "SYNC_GENERATION_FILE": os.path.join(workdir, "sync_generation"),
+        "PROFILE_DB_PATH": os.path.join(workdir, "user_profiles.sqlite3"),
+        "TAG_DICTIONARY_FILE": os.path.join(workdir, "tag_dictionary.json"),
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite3"),
+        "COVISITATION_DIR": os.path.join(workdir, "covisitation"),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Child process: run one entry point
+# ---------------------------------------------------------------------------
+
+class HashBackend:
+    """Deterministic pseudo-embeddings (unit vectors seeded by the text hash)."""
+    name = "hash"
+
+    def embed(self, texts: list) -> np.ndarray:
+        vectors = np.empty((len(texts), 384), dtype=np.float32)
+        for i, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.md5(text.encode("utf-8")).digest()[:8], "little")
+            vec = np.random.default_rng(seed).standard_normal(384)
+            vectors[i] = vec / np.linalg.norm(vec)
+        return vectors
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def qdrant_client(args, workdir: str):
+    from qdrant_client import QdrantClient
+
+    if args.qdrant == "local":
+        return QdrantClient(path=os.path.join(workdir, "qdrant"))
+    return QdrantClient(url=args.qdrant)
+
+
+def measure(fn, calls: list, concurrency: int):
+    """Run fn over calls; returns (latencies in seconds, wall time, results)."""
+    def timed(arg):
+        start = time.perf_counter()
+        result = fn(arg)
+        return time.perf_counter() - start, result
+
+    start = time.perf_counter()
+    if concurrency <= 1:
+        timings = [timed(arg) for arg in calls]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            timings = list(executor.map(timed, calls))
+    wall = time.perf_counter() - start
+    return [t for t, _ in timings], wall, [r for _, r in timings]
+
+
+def summarize(latencies: list, wall: float, items: int, round_trips: int) -> dict:
+    ms = np.array(latencies) * 1000
+    return {
+        "calls": len(latencies),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "mean_ms": float(ms.mean()),
+        "max_ms": float(ms.max()),
+        "wall_s": wall,
+        "throughput_per_sec": len(latencies) / wall if wall else 0.0,
+        "items_per_sec": items / wall if wall else 0.0,
+        "db_round_trips": round_trips,
+        "db_round_trips_per_call": round_trips / len(latencies),
+    }
+
+
+def run_child(args, workdir: str) -> dict:
+    db_path = os.path.join(workdir, "catalog.sqlite3")
+    sqlite_db.install(db_path)
+
+    import embedder
+    if args.embedder == "hash":
+        embedder.EMBEDDER_BACKEND = "hash"
+        embedder._backend = HashBackend()
+
+    # The in-process index needs no Qdrant client
+    client = qdrant_client(args, workdir) if args.search_backend == "qdrant" else None
+    entry = args.child
+    rng = np.random.default_rng(args.seed + 100)
+    errors = 0
+
+    if entry in ("sync_full", "sync_incremental"):
+        from sync_products import sync_products
+        import sync_products as sync_module
+        sync_module.SEARCH_BACKEND = args.search_backend
+        if args.qdrant == "local":
+            # The embedded client is not safe for concurrent upserts
+            sync_module.UPSERT_WORKERS = 1
+        before = sqlite_db.round_trips.count
+        latencies, wall, _ = measure(
+            lambda _: sync_products(full=entry == "sync_full", client=client), [None], 1
+        )
+        stats = summarize(latencies, wall, args.products, sqlite_db.round_trips.count - before)
+
+    elif entry == "train_model":
+        import mysql.connector
+        mysql.connector.connect = sqlite_db.connect(db_path)
+        before = sqlite_db.round_trips.count
+        latencies, wall, _ = measure(
+            lambda _: runpy.run_path(os.path.join(AI_DIR, "train_model.py"), run_name="__main__"), [None], 1
+        )
+        stats = summarize(latencies, wall, args.users, sqlite_db.round_trips.count - before)
+
+    else:
+        import recommend
+        from search_backend import LocalBackend, QdrantBackend
+        recommend.backend = QdrantBackend(client) if client is not None else LocalBackend()
+
+        if entry == "recommend_for_product":
+            fn = lambda pid: recommend.recommend_for_product(pid)
+            calls = [int(pid) for pid in rng.integers(1, args.products + 1, size=args.warmup + args.requests)]
+            items_per_call = 1
+        else:
+            # Active users ask for recommendations more often
+            weights = catalog.user_activity_counts(catalog_config(args)) + 1.0
+            user_ids = rng.choice(args.users, size=args.warmup + args.requests, p=weights / weights.sum()) + 1
+            if entry == "recommend_for_user":
+                fn = lambda uid: recommend.recommend_for_user(uid)
+                calls = [int(uid) for uid in user_ids]
+                items_per_call = 1
+            else:
+                fn = lambda uids: recommend.recommend_for_users(uids)
+                calls = [
+                    [int(uid) for uid in rng.choice(args.users, size=args.batch_size, p=weights / weights.sum()) + 1]
+                    for _ in range(args.warmup + args.requests)
+                ]
+                items_per_call = args.batch_size
+
+        measure(fn, calls[:args.warmup], args.concurrency)
+        before = sqlite_db.round_trips.count
+        latencies, wall, results = measure(fn, calls[args.warmup:], args.concurrency)
+        stats = summarize(latencies, wall, len(latencies) * items_per_call, sqlite_db.round_trips.count - before)
+
+        for result in results:
+            for response in result if isinstance(result, list) else [result]:
+                if isinstance(response, dict) and "error" in response:
+                    errors += 1
+
+    stats["errors"] = errors
+    stats["peak_rss_mb"] = peak_rss_mb()
+    return stats
+
+
+# ---------------------------------------------------------------------------
+# Parent process: build the catalog, run each entry point in a child
+# ---------------------------------------------------------------------------
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=AI_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def spawn(entry: str, argv: list, env: dict) -> dict:
+    proc = subprocess.run(
+        [sys.executable, "-m", "benchmarks.run", *argv, "--child", entry],
+        cwd=AI_DIR, env=env, capture_output=True, text=True
+    )
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    tail = "\n".join((proc.stdout + proc.stderr).splitlines()[-20:])
+    raise RuntimeError(f"{entry} failed (exit code {proc.returncode}):\n{tail}")
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    args = parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="ai-bench-")
+    os.makedirs(workdir, exist_ok=True)
+
+    if args.child:
+        os.environ.update(data_env(workdir))
+        stats = run_child(args, workdir)
+        print(RESULT_MARKER + json.dumps(stats))
+        return
+
+    if not args.workdir:
+        argv += ["--workdir", workdir]
+    env = {**os.environ, **data_env(workdir)}
+
+    try:
+        config = catalog_config(args)
+        print(f"Generating catalog ({config.products} products, {config.users} users)...", file=sys.stderr)
+        start = time.perf_counter()
+        counts = sqlite_db.create_database(os.path.join(workdir, "catalog.sqlite3"), config)
+        print(f"   ...done in {time.perf_counter() - start:.1f}s: {counts}", file=sys.stderr)
+
+        results = {}
+        for entry in args.entry or ENTRY_POINTS:
+            if entry == "sync_incremental":
+                touched = sqlite_db.touch_products(os.path.join(workdir, "catalog.sqlite3"), args.touch_fraction)
+                print(f"Changed {touched} products", file=sys.stderr)
+            print(f"Running {entry}...", file=sys.stderr)
+            results[entry] = spawn(entry, argv, env)
+
+        report = {
+            "meta": {
+                "commit": git_commit(),
+                "timestamp": datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "config": {k: v for k, v in vars(args).items() if k not in ("child", "output", "workdir")},
+                "rows": counts,
+            },
+            "results": results,
+        }
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"✅ Wrote {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
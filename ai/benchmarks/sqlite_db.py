@@ -0,0 +1,209 @@
+# benchmarks/sqlite_db.py
+"""
+SQLite stand-in for the MySQL database.
+
+Creates the tables the AI service reads (same names and columns as the
+Laravel migrations) and wraps sqlite3 in the small subset of the
+mysql.connector API the service uses: %s placeholders, dictionary cursors,
+fetchmany, executemany, ping and consume_results. Every execute counts as
+one DB round trip. DECIMAL columns come back as decimal.Decimal, as they do
+from mysql.connector.
+"""
+import os
+import re
+import sqlite3
+import threading
+from decimal import Decimal
+from typing import Optional
+
+from benchmarks import catalog
+
+SCHEMA = """
+CREATE TABLE categories (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    slug TEXT NOT NULL,
+    description TEXT,
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE TABLE products (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT,
+    category_id INTEGER NOT NULL REFERENCES categories (id),
+    tags TEXT,
+    price DECIMAL(10, 2) NOT NULL,
+    image_url TEXT,
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE INDEX products_category_id ON products (category_id);
+CREATE TABLE visited_products (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    visited_at TEXT NOT NULL,
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE INDEX visited_products_user_id ON visited_products (user_id);
+CREATE TABLE purchased_products (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    purchased_at TEXT NOT NULL,
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE INDEX purchased_products_user_id ON purchased_products (user_id);
+CREATE TABLE recommendations (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    recommended_products TEXT NOT NULL,
+    created_at TEXT,
+    updated_at TEXT
+);
+"""
+
+INSERTS = {
+    "categories": "INSERT INTO categories (id, name, slug, description, created_at, updated_at) "
+                  "VALUES (?, ?, ?, ?, ?, ?)",
+    "products": "INSERT INTO products (id, name, description, category_id, tags, price, image_url, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+    "visited_products": "INSERT INTO visited_products (user_id, product_id, visited_at, created_at, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+    "purchased_products": "INSERT INTO purchased_products (user_id, product_id, purchased_at, created_at, "
+                          "updated_at) VALUES (?, ?, ?, ?, ?)",
+}
+
+
+def create_database(path: str, config: catalog.CatalogConfig) -> dict:
+    """Write a fresh database with the synthetic catalog; returns row counts."""
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.executescript(SCHEMA)
+        counts = {}
+        conn.execute("BEGIN")
+        conn.executemany(INSERTS["categories"], catalog.categories(config))
+        counts["categories"] = config.category_count
+        for rows in catalog.products(config):
+            conn.executemany(INSERTS["products"], rows)
+            counts["products"] = counts.get("products", 0) + len(rows)
+        for table, rows in catalog.interactions(config):
+            conn.executemany(INSERTS[table], rows)
+            counts[table] = counts.get(table, 0) + len(rows)
+        conn.execute("COMMIT")
+        return counts
+    finally:
+        conn.close()
+
+
+def touch_products(path: str, fraction: float, seed: int = 7) -> int:
+    """Change the description of a random fraction of products (for incremental sync runs)."""
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        total = conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+        count = max(1, int(total * fraction))
+        conn.execute(
+            "UPDATE products SET description = description || ' (updated)' "
+            "WHERE id IN (SELECT id FROM products ORDER BY (id * ?) % 1000003 LIMIT ?)",
+            (seed, count)
+        )
+        return count
+    finally:
+        conn.close()
+
+
+class RoundTripCounter:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def add(self, n: int = 1):
+        with self._lock:
+            self.count += n
+
+
+round_trips = RoundTripCounter()
+
+_PLACEHOLDER = re.compile(r"%s")
+
+# Read DECIMAL(10, 2) columns back as Decimal (needs PARSE_DECLTYPES on the connection)
+sqlite3.register_converter("DECIMAL", lambda raw: Decimal(raw.decode("ascii")).quantize(Decimal("0.01")))
+
+
+class Cursor:
+
+    def __init__(self, conn: sqlite3.Connection, dictionary: bool):
+        self._cursor = conn.cursor()
+        self.dictionary = dictionary
+
+    def _row(self, row):
+        if row is None or not self.dictionary:
+            return row
+        return {col[0]: value for col, value in zip(self._cursor.description, row)}
+
+    def execute(self, query: str, params=()):
+        round_trips.add()
+        self._cursor.execute(_PLACEHOLDER.sub("?", query), tuple(params or ()))
+
+    def executemany(self, query: str, rows):
+        round_trips.add()
+        self._cursor.executemany(_PLACEHOLDER.sub("?", query), rows)
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size: int = 1):
+        return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def close(self):
+        self._cursor.close()
+
+
+class Connection:
+    """sqlite3 connection with the mysql.connector methods the service calls."""
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(
+            path, timeout=30, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES
+        )
+        self.autocommit = False  # the service only reads; train_model commits explicitly
+
+    def cursor(self, dictionary: bool = False, buffered: Optional[bool] = None):
+        return Cursor(self._conn, dictionary)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def ping(self, reconnect: bool = False):
+        pass
+
+    def consume_results(self):
+        pass
+
+    def close(self):
+        self._conn.close()
+
+
+def install(path: str):
+    """Point the shared connection pool (db_pool.pool) at the SQLite database."""
+    import db_pool
+
+    db_pool.pool.close_all()
+    db_pool.pool._connect = lambda: Connection(path)
+
+
+def connect(path: str):
+    """Replacement for mysql.connector.connect, for scripts like train_model.py."""
+    return lambda **kwargs: Connection(path)
@@ -0,0 +1,233 @@
+# covisitation.py
+"""
+Item-to-item co-visitation model built from views and purchases.
+
+train_model.py builds it: every interaction gets a weight (purchases count
+more, older interactions decay with a half-life), the user x item weight
+matrix U gives the co-occurrence matrix U^T U, normalised to cosine so that
+popular items do not neighbour everything, and each row is pruned to its
+top-k neighbours. Rows are computed in blocks, so only a block of the
+item x item matrix exists at a time.
+
+The model is stored as CSR arrays (indptr, neighbour ids, scores) that are
+memory-mapped on read. Rows are indexed directly by product id, so the
+neighbours of a seed product are one O(k) slice. Each retrain writes a new
+storage.GenerationDir generation, so it never exposes a partial model to
+the running service.
+"""
+import os
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+from storage import GenerationDir
+
+COVISITATION_DIR = os.getenv(
+    "COVISITATION_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "covisitation")
+)
+# Added to a candidate's rerank score per unit of (seed-weighted) co-visitation similarity
+COVISITATION_WEIGHT = float(os.getenv("COVISITATION_WEIGHT", "0.3"))
+
+HALF_LIFE_DAYS = 30.0        # an interaction counts half as much after this long
+PURCHASE_WEIGHT = 3.0        # a purchase counts as this many views
+TOP_K = 50                   # neighbours kept per product
+MAX_EVENTS_PER_USER = 200    # most recent interactions used per user
+ITEM_BLOCK_ROWS = 1024       # item rows of U^T U computed at a time
+
+
+def interaction_weights(timestamps: np.ndarray, is_purchase: np.ndarray,
+                        half_life_days: float = HALF_LIFE_DAYS,
+                        purchase_weight: float = PURCHASE_WEIGHT) -> np.ndarray:
+    """Per-interaction weight, decayed relative to the newest interaction (timestamps in seconds)."""
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if len(timestamps) == 0:
+        return timestamps
+    age_days = (timestamps.max() - timestamps) / 86400.0
+    return np.where(is_purchase, purchase_weight, 1.0) * 0.5 ** (age_days / half_life_days)
+
+
+def most_recent_per_user(user_index: np.ndarray, timestamps: np.ndarray,
+                         max_events: int = MAX_EVENTS_PER_USER) -> np.ndarray:
+    """Mask keeping each user's max_events most recent interactions (bounds the pairs per user)."""
+    order = np.lexsort((-np.asarray(timestamps), user_index))
+    users = np.asarray(user_index)[order]
+    starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+    rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    keep = np.zeros(len(order), dtype=bool)
+    keep[order[rank < max_events]] = True
+    return keep
+
+
+def top_k_per_row(matrix, k: int):
+    """
+    Top-k entries of every row of a sparse CSR matrix, by value.
+    Works on the non-zeros only: entries are ordered by (row, -value) and
+    each one's rank within its row decides whether it is kept.
+
+    Returns:
+        (rows, cols, values) arrays of the kept entries, best first within each row
+    """
+    matrix = matrix.tocsr()
+    row_of = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    order = np.lexsort((-matrix.data, row_of))
+    rank = np.arange(len(order)) - matrix.indptr[row_of[order]]
+    keep = order[rank < k]
+    return row_of[keep], matrix.indices[keep], matrix.data[keep]
+
+
+def build_matrix(user_index: np.ndarray, item_index: np.ndarray, weights: np.ndarray, n_items: int,
+                 top_k: int = TOP_K, block_rows: int = ITEM_BLOCK_ROWS):
+    """
+    Top-k cosine co-visitation neighbours of every item.
+
+    Args:
+        user_index, item_index: Row / column of each interaction (0-based)
+        weights: Weight of each interaction (repeats of a pair add up)
+        n_items: Number of items (columns)
+
+    Returns:
+        Sparse CSR (n_items x n_items) matrix with at most top_k entries per row
+    """
+    from scipy import sparse  # only needed for training, not by the service
+
+    n_users = int(user_index.max()) + 1 if len(user_index) else 0
+    interactions = sparse.csr_matrix(
+        (np.asarray(weights, dtype=np.float64), (user_index, item_index)), shape=(n_users, n_items)
+    )
+    interactions.sum_duplicates()
+    norms = np.sqrt(np.asarray(interactions.multiply(interactions).sum(axis=0)).ravel())
+    by_item = interactions.T.tocsr()
+
+    rows, cols, vals = [], [], []
+    for start in range(0, n_items, block_rows):
+        stop = min(start + block_rows, n_items)
+        block = (by_item[start:stop] @ interactions).tocoo()
+
+        # Drop self-pairs, normalise co-occurrence weight to cosine
+        keep = block.col != block.row + start
+        r, c = block.row[keep], block.col[keep]
+        v = block.data[keep] / (norms[r + start] * norms[c])
+        block = sparse.csr_matrix((v.astype(np.float32), (r, c)), shape=(stop - start, n_items))
+
+        block_rows_kept, block_cols, block_vals = top_k_per_row(block, top_k)
+        rows.append(block_rows_kept + start)
+        cols.append(block_cols)
+        vals.append(block_vals)
+
+    if not rows:
+        return sparse.csr_matrix((n_items, n_items), dtype=np.float32)
+    return sparse.csr_matrix(
+        (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(n_items, n_items)
+    )
+
+
+class CovisitationModel:
+    """Memory-mapped product_id -> (neighbour ids, scores) lookup."""
+
+    def __init__(self, path: str = COVISITATION_DIR):
+        self.path = path
+        self.generations = GenerationDir(path)
+        # (indptr, neighbours, scores) swapped as one tuple
+        self._state: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+
+    def _files(self, generation: str) -> Tuple[str, str, str]:
+        return (
+            self.generations.file("indptr", generation, ".npy"),
+            self.generations.file("neighbours", generation, ".npy"),
+            self.generations.file("scores", generation, ".npy"),
+        )
+
+    def save(self, matrix, product_ids: np.ndarray):
+        """
+        Publish a model.
+
+        Args:
+            matrix: Sparse (n x n) neighbour matrix from build_matrix
+            product_ids: Product id of each row / column index
+        """
+        matrix = matrix.tocsr()
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+
+        # Re-key rows by product id, best neighbour first within each row
+        row_ids = product_ids[rows]
+        order = np.lexsort((-matrix.data, row_ids))
+        max_id = int(product_ids.max()) if len(product_ids) else -1
+        indptr = np.zeros(max_id + 2, dtype=np.int64)
+        np.cumsum(np.bincount(row_ids, minlength=max_id + 1), out=indptr[1:])
+        neighbours = product_ids[matrix.indices[order]].astype(np.int32)
+        scores = matrix.data[order].astype(np.float32)
+
+        generation = self.generations.start()
+        try:
+            for target, array in zip(self._files(generation), (indptr, neighbours, scores)):
+                np.save(target, array)
+        except BaseException:
+            self.generations.abort(generation)
+            raise
+        self.generations.publish(generation)
+
+    def _load(self, generation: str):
+        # Plain ndarray views of the maps: slicing np.memmap objects is several times slower
+        self._state = tuple(
+            np.load(f, mmap_mode="r").view(np.ndarray) for f in self._files(generation)
+        )
+
+    def _refresh(self):
+        self.generations.refresh(self._load)
+
+    def neighbours(self, product_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(neighbour ids, scores) of a product, best first; empty if it has none."""
+        self._refresh()
+        if self._state is None or not 0 <= product_id < len(self._state[0]) - 1:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        indptr, neighbours, scores = self._state
+        lo, hi = indptr[product_id], indptr[product_id + 1]
+        return neighbours[lo:hi], scores[lo:hi]
+
+    def scores(self, seed_ids: Iterable[int], seed_weights: Iterable[float], candidate_ids: np.ndarray) -> np.ndarray:
+        """
+        Weighted average co-visitation similarity of each candidate to the seed products.
+
+        Costs O(k) per seed to gather the neighbour rows, plus a binary search
+        of each neighbour among the candidates; candidates that neighbour no
+        seed (or no model yet) score 0.
+        """
+        candidate_ids = np.asarray(candidate_ids, dtype=np.int64)
+        seed_ids = np.fromiter(seed_ids, dtype=np.int64)
+        seed_weights = np.fromiter(seed_weights, dtype=np.float64)
+        self._refresh()
+        if self._state is None or len(candidate_ids) == 0 or not seed_weights.sum():
+            return np.zeros(len(candidate_ids))
+        indptr, neighbours, scores = self._state
+        total_weight = seed_weights.sum()
+
+        valid = (seed_ids >= 0) & (seed_ids < len(indptr) - 1)
+        seed_ids, seed_weights = seed_ids[valid], seed_weights[valid]
+        lo, hi = indptr[seed_ids], indptr[seed_ids + 1]
+        lengths = hi - lo
+        if not lengths.sum():
+            return np.zeros(len(candidate_ids))
+
+        # Concatenated positions of every seed's neighbour row
+        rows = np.repeat(lo - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        ids = neighbours[rows]
+        values = scores[rows] * np.repeat(seed_weights, lengths)
+
+        order = np.argsort(candidate_ids)
+        sorted_ids = candidate_ids[order]
+        pos = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        match = sorted_ids[pos] == ids
+        sums = np.zeros(len(candidate_ids))
+        sums[order] = np.bincount(pos[match], weights=values[match], minlength=len(sorted_ids))
+        return sums / total_weight
+
+    def __len__(self) -> int:
+        """Products with at least one neighbour."""
+        self._refresh()
+        return 0 if self._state is None else int(np.count_nonzero(np.diff(self._state[0])))
+
+
+model = CovisitationModel()
@@ -0,0 +1,236 @@
+# db_pool.py
+"""
+Shared MySQL connection pool for the AI service.
+
+Connections are created lazily up to DB_POOL_SIZE, health-checked when
+they have been idle for a while, and handed out through get_connection().
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import mysql.connector
+from mysql.connector import errors
+
+import metrics
+
+DB = {
+    "host": "127.0.0.1",
+    "user": "root",
+    "password": "",
+    "database": "ai_recommand"
+}
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))           # seconds to wait for a free connection
+POOL_PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER", "30"))    # ping connections idle longer than this
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of mysql.connector connections."""
+
+    def __init__(self, config: dict, size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT,
+                 ping_after: float = POOL_PING_AFTER):
+        self.config = config
+        self.size = size
+        self.timeout = timeout
+        self.ping_after = ping_after
+
+        self._cond = threading.Condition()
+        self._idle = deque()   # (connection, last_used) pairs, most recent on the right
+        self._open = 0         # connections created and not yet discarded
+
+        self._stats = {
+            "checkouts": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "exhausted": 0,     # checkouts that found the pool at capacity
+            "timeouts": 0,
+            "created": 0,
+            "discarded": 0,
+        }
+
+    def _connect(self):
+        conn = mysql.connector.connect(**self.config)
+        # Each checkout must see fresh data, not a transaction snapshot
+        conn.autocommit = True
+        return conn
+
+    def _healthy(self, conn, last_used: float) -> bool:
+        if time.monotonic() - last_used < self.ping_after:
+            return True
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except errors.Error:
+            return False
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except errors.Error:
+            pass
+
+    def acquire(self):
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.timeout
+        idle = None
+
+        with self._cond:
+            waited = False
+            while True:
+                if self._idle:
+                    idle = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    self._open += 1
+                    break
+                if not waited:
+                    self._stats["exhausted"] += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise errors.PoolError(
+                        f"No MySQL connection available after {self.timeout}s (pool size {self.size})"
+                    )
+                self._cond.wait(remaining)
+
+        conn = None
+        if idle is not None:
+            conn, last_used = idle
+            if not self._healthy(conn, last_used):
+                self._close(conn)
+                self._record("discarded")
+                conn = None
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._open -= 1
+                    self._cond.notify()
+                raise
+            self._record("created")
+
+        wait = time.perf_counter() - start
+        with self._cond:
+            self._stats["checkouts"] += 1
+            self._stats["wait_time_total"] += wait
+            self._stats["wait_time_max"] = max(self._stats["wait_time_max"], wait)
+
+        return conn
+
+    def release(self, conn, discard: bool = False):
+        if discard:
+            self._close(conn)
+        with self._cond:
+            if discard:
+                self._open -= 1
+                self._stats["discarded"] += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def _record(self, key: str):
+        with self._cond:
+            self._stats[key] += 1
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats["size"] = self.size
+            stats["open"] = self._open
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._open - len(self._idle)
+        checkouts = stats["checkouts"]
+        stats["wait_time_avg"] = stats["wait_time_total"] / checkouts if checkouts else 0.0
+        return stats
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+            self._open -= len(idle)
+        for conn, _ in idle:
+            self._close(conn)
+
+
+pool = ConnectionPool(DB)
+
+
+class _InstrumentedCursor:
+    """Cursor wrapper that counts and times queries for metrics."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, *args, **kwargs):
+        metrics.count("db_queries")
+        with metrics.span("db.query"):
+            return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        metrics.count("db_queries")
+        with metrics.span("db.query"):
+            return self._cursor.executemany(*args, **kwargs)
+
+    def fetchone(self):
+        with metrics.span("db.fetch"):
+            return self._cursor.fetchone()
+
+    def fetchmany(self, *args, **kwargs):
+        with metrics.span("db.fetch"):
+            return self._cursor.fetchmany(*args, **kwargs)
+
+    def fetchall(self):
+        with metrics.span("db.fetch"):
+            return self._cursor.fetchall()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _InstrumentedConnection:
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return _InstrumentedCursor(self._conn.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+@contextmanager
+def get_connection():
+    """
+    Check a connection out of the shared pool.
+
+    Usage:
+        with get_connection() as db:
+            cursor = db.cursor(dictionary=True)
+            ...
+
+    Connections that raise a MySQL error are discarded instead of reused.
+    """
+    with metrics.span("db.checkout"):
+        conn = pool.acquire()
+    try:
+        yield _InstrumentedConnection(conn)
+    except errors.Error:
+        pool.release(conn, discard=True)
+        raise
+    except BaseException:
+        pool.release(conn)
+        raise
+    else:
+        pool.release(conn)
+
+
+def pool_stats() -> dict:
+    """Counters for checkouts, wait time and exhaustion of the shared pool."""
+    return pool.stats()
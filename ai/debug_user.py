@@ -12,21 +12,20 @@ def debug_user(user_id: int):
     print(f"{'='*60}\n")
     
     # 1. Fetch user activity
-    from user_profile import fetch_user_activity
     activity = fetch_user_activity(user_id)
     
     print(f"📊 User Activity Summary:")
-    print(f"   Views: {len(activity['views'])} products")
-    print(f"   Purchases: {len(activity['purchases'])} products")
-    print(f"   Total interactions: {len(set(activity['views'] + activity['purchases']))} unique products\n")
+    print(f"   Views: {len(activity.views)} products")
+    print(f"   Purchases: {len(activity.purchases)} products")
+    print(f"   Total interactions: {len(set(activity.views + activity.purchases))} unique products\n")
     
     # 2. Get interacted products
-    interacted = get_user_interacted_products(user_id)
+    interacted = get_user_interacted_products(user_id, activity=activity)
     print(f"🚫 Excluded Products: {len(interacted)} products")
     print(f"   Product IDs: {sorted(list(interacted))}\n")
     
     # 3. Get top representative products
-    top_products = get_top_representative_products(user_id, max_products=10)
+    top_products = get_top_representative_products(user_id, max_products=10, activity=activity)
     print(f"⭐ Top Representative Products: {len(top_products)} products")
     print(f"   Product IDs: {top_products}\n")
     
@@ -39,17 +38,17 @@ def debug_user(user_id: int):
                 prod = products[pid]
                 print(f"   ID {pid}: {prod.get('name', 'N/A')[:50]}")
                 print(f"      Category: {prod.get('category_name', 'N/A')} (ID: {prod.get('category_id', 'N/A')})")
-                print(f"      Type: {'PURCHASED' if pid in activity['purchases'] else 'VIEWED' if pid in activity['views'] else 'FALLBACK'}")
+                print(f"      Type: {'PURCHASED' if pid in activity.purchases else 'VIEWED' if pid in activity.views else 'FALLBACK'}")
         print()
     
     # 5. Calculate category weights
     user_categories = {}
-    for pid in activity['purchases']:
+    for pid in activity.purchases:
         prod = fetch_product(pid)
         if prod and prod.get('category_id'):
             user_categories[prod['category_id']] = user_categories.get(prod['category_id'], 0) + 2.0
     
-    for pid in activity['views']:
+    for pid in activity.views:
         prod = fetch_product(pid)
         if prod and prod.get('category_id'):
             user_categories[prod['category_id']] = user_categories.get(prod['category_id'], 0) + 1.0
@@ -125,7 +124,7 @@ def debug_user(user_id: int):
         scroll_result = client.scroll(
             collection_name="products",
             limit=1000,
-            with_payload=True
+            with_payload=["id", "category_id"]
         )
         
         qdrant_products = {p.payload['id']: p.payload for p in scroll_result[0]}
@@ -1,28 +1,341 @@
 # embedder.py
-import torch
-from transformers import AutoTokenizer, AutoModel
+"""
+MiniLM sentence embeddings.
+
+Two interchangeable inference backends, picked with EMBEDDER_BACKEND:
+
+- torch: the transformers model in fp32 (default)
+- onnx:  the same model exported to ONNX and run with ONNX Runtime,
+         optionally int8-quantized (needs the `onnxruntime` and `onnx` packages)
+
+The backend (and torch / transformers / onnxruntime) is loaded on first use
+(or by warm_up), so importing this module is cheap for code paths that never
+embed.
+
+CLI:
+    python embedder.py export [--quantize]    # write the ONNX model
+    python embedder.py check [--quantize]     # compare ONNX against torch
+"""
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import metrics
+from embedding_cache import cache as embedding_cache, embedding_key
 
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384
+BATCH_SIZE = 64
+
+EMBEDDER_BACKEND = os.getenv("EMBEDDER_BACKEND", "torch")
+# Threads per forward pass (torch.set_num_threads / ORT intra-op threads);
+# 0 keeps the library default
+EMBEDDER_THREADS = int(os.getenv("EMBEDDER_THREADS", "0"))
+ONNX_MODEL_DIR = os.getenv(
+    "ONNX_MODEL_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "onnx")
+)
+ONNX_QUANTIZE = os.getenv("ONNX_QUANTIZE", "0") == "1"
+ONNX_OPSET = 14
+
+# Minimum cosine similarity to the torch embeddings accepted by `check`
+MIN_ACCURACY_COSINE = 0.98
+
+# Model inference runs on its own small executor: each backend already
+# parallelises a forward pass, so running many at once only adds contention.
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="embed")
+
+
+def _mean_pool(last_hidden_state: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+    # Mean Pooling (standard for MiniLM), ignoring padding tokens
+    mask = attention_mask[..., None].astype(last_hidden_state.dtype)
+    summed = (last_hidden_state * mask).sum(axis=1)
+    counts = np.clip(mask.sum(axis=1), 1e-9, None)
+    return summed / counts
+
+
+def _normalize(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return (embeddings / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+
+class TorchBackend:
+    name = "torch"
+
+    def __init__(self, threads: int = EMBEDDER_THREADS):
+        import torch
+        from transformers import AutoTokenizer, AutoModel
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+        self.model = AutoModel.from_pretrained(MODEL_NAME)
+        self.model.eval()
+
+    def embed(self, texts: list) -> np.ndarray:
+        """One forward pass; returns normalized float32 embeddings."""
+        inputs = self.tokenizer(texts, return_tensors="pt", truncation=True, padding=True)
+        with self.torch.no_grad():
+            hidden = self.model(**inputs).last_hidden_state
+        return _normalize(_mean_pool(hidden.numpy(), inputs["attention_mask"].numpy()))
+
+
+def onnx_model_path(quantize: bool = ONNX_QUANTIZE) -> str:
+    return os.path.join(ONNX_MODEL_DIR, "model-int8.onnx" if quantize else "model.onnx")
+
+
+def export_onnx(quantize: bool = ONNX_QUANTIZE) -> str:
+    """
+    Export the model to ONNX (and optionally int8 dynamic quantization).
+
+    Returns:
+        Path of the model file the onnx backend should load
+    """
+    import torch
+    from transformers import AutoTokenizer, AutoModel
+
+    os.makedirs(ONNX_MODEL_DIR, exist_ok=True)
+    fp32_path = onnx_model_path(quantize=False)
+
+    if not os.path.exists(fp32_path):
+        tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+        model = AutoModel.from_pretrained(MODEL_NAME)
+        model.eval()
+
+        sample = tokenizer(["export sample"], return_tensors="pt")
+        input_names = ["input_ids", "attention_mask", "token_type_ids"]
+        tmp = fp32_path + ".tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                tuple(sample[name] for name in input_names),
+                tmp,
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes={
+                    name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]
+                },
+                opset_version=ONNX_OPSET
+            )
+        os.replace(tmp, fp32_path)
+        print(f"✅ Exported ONNX model to {fp32_path}")
+
+    if not quantize:
+        return fp32_path
+
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    int8_path = onnx_model_path(quantize=True)
+    tmp = int8_path + ".tmp"
+    quantize_dynamic(fp32_path, tmp, weight_type=QuantType.QInt8)
+    os.replace(tmp, int8_path)
+    print(f"✅ Quantized ONNX model written to {int8_path}")
+    return int8_path
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, threads: int = EMBEDDER_THREADS, quantize: bool = ONNX_QUANTIZE):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        path = onnx_model_path(quantize)
+        if not os.path.exists(path):
+            path = export_onnx(quantize)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+
+        self.quantize = quantize
+        self.tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
 
-print("🔥 Loading MiniLM model (fast + lightweight)...")
+    def embed(self, texts: list) -> np.ndarray:
+        """One forward pass; returns normalized float32 embeddings."""
+        inputs = self.tokenizer(texts, return_tensors="np", truncation=True, padding=True)
+        feed = {name: value.astype(np.int64) for name, value in inputs.items() if name in self.input_names}
+        hidden = self.session.run(["last_hidden_state"], feed)[0]
+        return _normalize(_mean_pool(hidden, inputs["attention_mask"]))
 
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-model = AutoModel.from_pretrained(MODEL_NAME)
-model.eval()
 
-print("✅ MiniLM loaded successfully!")
+BACKENDS = {
+    "torch": TorchBackend,
+    "onnx": OnnxBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def load_backend():
+    """
+    Create the configured backend on first call; later calls return the same one.
+
+    Thread-safe: concurrent first callers wait for a single load.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if EMBEDDER_BACKEND not in BACKENDS:
+                    raise ValueError(f"Unknown EMBEDDER_BACKEND: {EMBEDDER_BACKEND}")
+                print(f"🔥 Loading MiniLM model ({EMBEDDER_BACKEND} backend)...")
+                _backend = BACKENDS[EMBEDDER_BACKEND]()
+                print("✅ MiniLM loaded successfully!")
+    return _backend
+
+
+def model_key() -> str:
+    """Identifies the model + backend variant in embedding cache keys."""
+    if EMBEDDER_BACKEND == "onnx" and ONNX_QUANTIZE:
+        return f"{MODEL_NAME}:onnx-int8"
+    return f"{MODEL_NAME}:{EMBEDDER_BACKEND}"
+
+
+def is_loaded() -> bool:
+    return _backend is not None
+
+
+def warm_up():
+    """
+    Load the model and run one forward pass so the first request doesn't pay for it.
+
+    Bypasses the embedding cache (a cached text would skip the model) and runs
+    on the calling thread, so submit it to inference_executor rather than
+    calling it from a thread that is waiting on the executor.
+    """
+    _embed_batch(["warm up"], 1)
+
+
+def _embed_with(backend, texts: list, batch_size: int) -> np.ndarray:
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    vectors = np.empty((len(texts), EMBEDDING_DIM), dtype=np.float32)
+
+    for start in range(0, len(order), batch_size):
+        batch_idx = order[start:start + batch_size]
+        vectors[batch_idx] = backend.embed([texts[i] for i in batch_idx])
+
+    return vectors
+
+
+def _embed_batch(texts: list, batch_size: int) -> np.ndarray:
+    return _embed_with(load_backend(), texts, batch_size)
+
+
+def _run_model(texts: list, batch_size: int) -> np.ndarray:
+    metrics.count("embedded_texts", len(texts))
+    # Includes any wait for a free inference worker
+    with metrics.span("embed.model"):
+        return inference_executor.submit(_embed_batch, texts, batch_size).result()
+
+
+def embed_batch(texts, batch_size: int = BATCH_SIZE):
+    """
+    Embed many texts with batched forward passes.
+
+    Inputs are sorted by length so each batch pads to a similar size, and
+    pooling uses the attention mask so results match single-text calls.
+
+    Texts embedded before (by this model and backend) come from the
+    embedding cache; only the rest run on the bounded inference executor,
+    so callers on any thread share the same small set of model workers.
+
+    Args:
+        texts: List of strings
+        batch_size: Number of texts per forward pass
+
+    Returns:
+        float32 numpy array of shape (len(texts), dim), in input order
+    """
+    texts = list(texts)
+    if not texts:
+        return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+    if embedding_cache is None:
+        return _run_model(texts, batch_size)
+
+    model = model_key()
+    keys = [embedding_key(model, text) for text in texts]
+    with metrics.span("embed.cache_lookup"):
+        found = embedding_cache.get_many(keys)
+
+    # Embed each missing text once, even if it repeats in the input
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in found and key not in missing:
+            missing[key] = text
+    if missing:
+        computed = _run_model(list(missing.values()), batch_size)
+        embedding_cache.put_many(list(zip(missing.keys(), computed)))
+        found.update(zip(missing.keys(), computed))
+
+    return np.stack([found[key] for key in keys]).astype(np.float32, copy=False)
 
 
 def embed_text(text: str):
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, padding=True)
+    return embed_batch([text])[0]
+
+
+SAMPLE_TEXTS = [
+    "Wireless noise cancelling headphones Over-ear Bluetooth headphones with 30h battery Electronics audio bluetooth",
+    "The Pragmatic Programmer Classic book on software craftsmanship Books programming career",
+    "Stainless steel garden trowel Rust-resistant hand tool for planting Garden tools outdoor",
+    "Wooden building blocks 100 colourful blocks for toddlers Toys kids educational",
+    "Running shoes Lightweight trainers with breathable mesh Sports running fitness",
+    "Espresso machine 15 bar pump with milk frother Kitchen coffee appliances",
+    "phone case",
+    "",
+]
+
+
+def check_accuracy(texts: list = None, quantize: bool = ONNX_QUANTIZE,
+                   batch_size: int = BATCH_SIZE) -> dict:
+    """
+    Compare the ONNX backend against torch on the same texts.
+
+    Returns:
+        Cosine similarity between the two embeddings of each text (min / mean)
+        and the throughput of each backend in texts per second
+    """
+    texts = list(texts or SAMPLE_TEXTS)
+    results = {"texts": len(texts), "quantized": quantize}
+    embeddings = {}
+
+    for name, backend in (("torch", TorchBackend()), ("onnx", OnnxBackend(quantize=quantize))):
+        _embed_with(backend, texts[:batch_size], batch_size)  # warm-up pass
+        start = time.perf_counter()
+        embeddings[name] = _embed_with(backend, texts, batch_size)
+        results[f"{name}_texts_per_sec"] = len(texts) / (time.perf_counter() - start)
 
-    with torch.no_grad():
-        model_output = model(**inputs)
+    cosine = (embeddings["torch"] * embeddings["onnx"]).sum(axis=1)
+    results["min_cosine"] = float(cosine.min())
+    results["mean_cosine"] = float(cosine.mean())
+    results["ok"] = results["min_cosine"] >= MIN_ACCURACY_COSINE
+    return results
 
-    # Mean Pooling (standard for MiniLM)
-    embeddings = model_output.last_hidden_state.mean(dim=1)
 
-    # Normalize the embeddings
-    embeddings = torch.nn.functional.normalize(embeddings, p=2, dim=1)
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "check"
+    quantize = "--quantize" in sys.argv[2:] or ONNX_QUANTIZE
 
-    return embeddings[0].numpy()
+    if command == "export":
+        export_onnx(quantize)
+    elif command == "check":
+        # Repeat the samples so throughput covers several full batches
+        report = check_accuracy(SAMPLE_TEXTS * 32, quantize=quantize)
+        for key, value in report.items():
+            print(f"{key}: {value}")
+        sys.exit(0 if report["ok"] else 1)
+    else:
+        print("Usage: python embedder.py [export|check] [--quantize]")
+        sys.exit(2)
@@ -0,0 +1,98 @@
+# embedding_cache.py
+"""
+Content-addressed cache of text embeddings.
+
+Keys are a hash of the model, the inference backend and the text, so a
+changed product text (or a different model) never hits a stale vector.
+Lookups go to an in-process LRU first and then to SQLite on disk, which
+survives restarts and is shared by every process on the host.
+"""
+import hashlib
+import os
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from rec_cache import LRUCache
+from storage import SQLiteConnections
+
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "embedding_cache.sqlite3")
+)
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE", "1") == "1"
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", "50000"))
+
+_SQLITE_BATCH = 500  # keys per IN (...) lookup, below SQLite's variable limit
+
+
+def embedding_key(model: str, text: str) -> bytes:
+    return hashlib.sha1(f"{model}\0{text}".encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, memory_entries: int = EMBEDDING_CACHE_MEMORY_ENTRIES):
+        self.path = path
+        self.memory = LRUCache(maxsize=memory_entries)
+        self.connections = SQLiteConnections(path, synchronous="NORMAL")
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self.connections.get().execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key BLOB PRIMARY KEY,
+                vector BLOB NOT NULL
+            ) WITHOUT ROWID
+        """)
+
+    def get_many(self, keys: Iterable[bytes]) -> Dict[bytes, np.ndarray]:
+        """Cached vectors for whichever keys are present."""
+        found = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            vector = self.memory.get(key)
+            if vector is None:
+                missing.append(key)
+            else:
+                found[key] = vector
+        memory_hits = len(found)
+
+        conn = self.connections.get()
+        for start in range(0, len(missing), _SQLITE_BATCH):
+            chunk = missing[start:start + _SQLITE_BATCH]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+            ).fetchall()
+            for key, blob in rows:
+                vector = np.frombuffer(blob, dtype=np.float32)
+                found[key] = vector
+                self.memory.set(key, vector, ttl=float("inf"))
+
+        with self._lock:
+            self._stats["memory_hits"] += memory_hits
+            self._stats["disk_hits"] += len(found) - memory_hits
+            self._stats["misses"] += len(missing) - (len(found) - memory_hits)
+        return found
+
+    def put_many(self, items: List[Tuple[bytes, np.ndarray]]):
+        rows = []
+        for key, vector in items:
+            vector = np.ascontiguousarray(vector, dtype=np.float32)
+            self.memory.set(key, vector, ttl=float("inf"))
+            rows.append((key, vector.tobytes()))
+        if rows:
+            with self.connections.transaction() as conn:
+                conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        total = sum(stats.values())
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / total if total else 0.0
+        stats["memory_entries"] = len(self.memory)
+        return stats
+
+
+cache = EmbeddingCache() if EMBEDDING_CACHE_ENABLED else None
@@ -0,0 +1,159 @@
+# metrics.py
+"""
+Per-stage timings and counters for the AI service.
+
+Code marks stages with `with span("qdrant.search"):` and counts work with
+`count("db_queries")`. Every span feeds a Prometheus histogram and every
+count a Prometheus counter (rendered by render_prometheus for /metrics).
+Inside `with trace() as t:` the same spans and counts are also collected
+per request, for the `?debug=timings` breakdown.
+
+Spans nest (a "db.query" span runs inside "fetch_user_activity"), so
+per-request span totals overlap rather than add up.
+"""
+import contextvars
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+# Seconds; covers cache hits through full syncs
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class Histogram:
+
+    def __init__(self, name: str, help_text: str, label: str, buckets: Tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series: Dict[str, list] = {}  # label value -> [bucket counts..., sum, count]
+
+    def observe(self, label_value: str, seconds: float):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in sorted(self._series.items())}
+        for value, data in series.items():
+            label = f'{self.label}="{value}"'
+            for bound, n in zip(self.buckets, data):
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {n}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {data[-1]}')
+            lines.append(f"{self.name}_sum{{{label}}} {data[-2]}")
+            lines.append(f"{self.name}_count{{{label}}} {data[-1]}")
+        return lines
+
+
+class Counters:
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._values: Dict[str, float] = defaultdict(float)
+
+    def inc(self, name: str, n: float = 1):
+        with self._lock:
+            self._values[name] += n
+
+    def render(self) -> list:
+        lines = []
+        with self._lock:
+            values = dict(sorted(self._values.items()))
+        for name, value in values.items():
+            metric = f"{self.prefix}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value:g}")
+        return lines
+
+
+stage_seconds = Histogram("ai_stage_seconds", "Time spent in each recommendation / sync stage", "stage")
+request_seconds = Histogram("ai_request_seconds", "HTTP request latency by route", "route")
+counters = Counters("ai")
+
+
+class Trace:
+    """Spans and counts collected for one request."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans: Dict[str, list] = {}       # name -> [total seconds, calls]
+        self.counts: Dict[str, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, seconds: float):
+        with self._lock:
+            entry = self.spans.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def add_count(self, name: str, n: float):
+        with self._lock:
+            self.counts[name] += n
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "total_ms": (time.perf_counter() - self.start) * 1000,
+                "spans_ms": {name: round(total * 1000, 3) for name, (total, _) in self.spans.items()},
+                "span_calls": {name: calls for name, (_, calls) in self.spans.items()},
+                "counters": dict(self.counts),
+            }
+
+
+_current: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+
+
+@contextmanager
+def trace():
+    """Collect the spans and counts of the enclosed code (same thread) into a Trace."""
+    current = Trace()
+    token = _current.set(current)
+    try:
+        yield current
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(name, elapsed)
+        current = _current.get()
+        if current is not None:
+            current.add_span(name, elapsed)
+
+
+def count(name: str, n: float = 1):
+    counters.inc(name, n)
+    current = _current.get()
+    if current is not None:
+        current.add_count(name, n)
+
+
+def traced(fn, *args, **kwargs):
+    """Call fn inside a fresh trace; returns (result, timings summary)."""
+    with trace() as current:
+        result = fn(*args, **kwargs)
+    return result, current.summary()
+
+
+def render_prometheus() -> str:
+    lines = stage_seconds.render() + request_seconds.render() + counters.render()
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,316 @@
+# profile_store.py
+"""
+Persistent per-user profile vectors with incremental updates.
+
+Each stored profile keeps the activity behind it: the recent purchase and
+view windows as MySQL returns them, the most viewed category with the
+candidates for its fallback slots, and which products the user purchased
+or viewed. Its items (the product selection of
+get_top_representative_products) are derived from these, along with the
+weighted sum of their vectors. A new view or purchase updates the
+windows and adjusts the sum with a few vector additions instead of
+rebuilding the profile from MySQL, and the profile vector is simply the
+normalised sum.
+
+Profiles are stored in SQLite next to the product vector store. A profile
+whose windows, category or purchases no longer match the activity loaded
+for a request (a missed or late event, a view that changed the top
+category) is rebuilt. A profile built before the last catalog sync is
+re-summed from the vector store (no DB queries, no embedding) the next
+time it is read.
+"""
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import numpy as np
+
+import metrics
+from rec_cache import cache as rec_cache
+from storage import SQLiteConnections
+from user_profile import (
+    UserActivity, fetch_user_activity, get_category_products, get_product_vectors,
+    profile_weight, MAX_RECENT_PURCHASES, MAX_RECENT_VIEWS,
+)
+
+PROFILE_DB_PATH = os.getenv(
+    "PROFILE_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "user_profiles.sqlite3")
+)
+MAX_PROFILE_PRODUCTS = 10
+# Enough category products to fill every fallback slot whatever the recent windows hold
+MAX_FALLBACK_CANDIDATES = MAX_PROFILE_PRODUCTS + MAX_RECENT_PURCHASES + MAX_RECENT_VIEWS
+# Rebuild from MySQL after this long, in case interaction events were missed
+PROFILE_REBUILD_AFTER = float(os.getenv("PROFILE_REBUILD_AFTER", "86400"))
+
+
+@dataclass
+class UserProfile:
+    user_id: int
+    purchase_window: List[int] = field(default_factory=list)    # activity.purchases[:MAX_RECENT_PURCHASES]
+    view_window: List[int] = field(default_factory=list)        # activity.views[:MAX_RECENT_VIEWS]
+    category: Optional[int] = None                              # most viewed category
+    category_products: List[int] = field(default_factory=list)  # fallback candidates from that category
+    purchased: List[int] = field(default_factory=list)          # every product the user purchased
+    viewed: List[int] = field(default_factory=list)             # viewed, not purchased candidates
+    vector_sum: Optional[np.ndarray] = None                     # sum of weight * product vector
+    generation: int = 0                                         # sync generation the sum was built against
+    built_at: float = 0.0                                       # when the profile was last built from MySQL
+
+    def product_ids(self) -> List[int]:
+        """Recent purchases, recent views, then category products for the slots left."""
+        selected = list(dict.fromkeys(self.purchase_window + self.view_window))[:MAX_PROFILE_PRODUCTS]
+        fallback = [pid for pid in self.category_products if pid not in selected]
+        return (selected + fallback)[:MAX_PROFILE_PRODUCTS]
+
+    def items(self):
+        """(product_id, weight) for every item in the profile."""
+        purchased, viewed = set(self.purchased), set(self.viewed)
+        return [(pid, profile_weight(pid, purchased, viewed)) for pid in self.product_ids()]
+
+    def candidates(self) -> set:
+        """Products that can be in the profile without a new event."""
+        return set(self.purchase_window) | set(self.view_window) | set(self.category_products)
+
+    def prune_history(self):
+        """Forget viewed flags of products that left the candidates (a new view sets them again)."""
+        candidates = self.candidates()
+        self.viewed = [pid for pid in self.viewed if pid in candidates and pid not in self.purchased]
+
+    def matches(self, activity: UserActivity) -> bool:
+        """Whether the profile reflects this activity snapshot."""
+        purchased = set(activity.purchases)
+        viewed = (set(activity.views) & self.candidates()) - purchased
+        return (
+            self.purchase_window == activity.purchases[:MAX_RECENT_PURCHASES]
+            and self.view_window == activity.views[:MAX_RECENT_VIEWS]
+            and self.category == activity.top_view_category()
+            and set(self.purchased) == purchased
+            and set(self.viewed) == viewed
+        )
+
+    def vector(self) -> Optional[np.ndarray]:
+        if self.vector_sum is None:
+            return None
+        norm = np.linalg.norm(self.vector_sum)
+        if norm == 0:
+            return None
+        return self.vector_sum / norm
+
+    def resum(self):
+        """Rebuild vector_sum from the current items; products without a vector add nothing."""
+        # Category products removed from the catalog are no longer candidates
+        candidate_vectors = get_product_vectors(self.category_products)
+        self.category_products = [pid for pid in self.category_products if pid in candidate_vectors]
+        self.prune_history()
+
+        items = self.items()
+        vectors = get_product_vectors([pid for pid, _ in items])
+        total = None
+        for pid, weight in items:
+            if pid in vectors:
+                contribution = weight * np.asarray(vectors[pid], dtype=np.float32)
+                total = contribution if total is None else total + contribution
+        self.vector_sum = total
+        self.generation = rec_cache.state.sync_generation()
+
+
+class ProfileStore:
+
+    def __init__(self, path: str = PROFILE_DB_PATH):
+        self.path = path
+        self.connections = SQLiteConnections(path)
+        self.connections.get().execute("""
+            CREATE TABLE IF NOT EXISTS user_profiles (
+                user_id INTEGER PRIMARY KEY,
+                items TEXT NOT NULL,
+                vector_sum BLOB,
+                generation INTEGER NOT NULL,
+                built_at REAL NOT NULL
+            )
+        """)
+
+    def get(self, user_id: int) -> Optional[UserProfile]:
+        row = self.connections.get().execute(
+            "SELECT items, vector_sum, generation, built_at FROM user_profiles WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        items = json.loads(row[0])
+        if "purchase_window" not in items:
+            return None  # stored before profiles kept their activity windows; rebuilt on next use
+        return UserProfile(
+            user_id=user_id,
+            purchase_window=items["purchase_window"],
+            view_window=items["view_window"],
+            category=items["category"],
+            category_products=items["category_products"],
+            purchased=items["purchased"],
+            viewed=items["viewed"],
+            vector_sum=np.frombuffer(row[1], dtype=np.float32).copy() if row[1] is not None else None,
+            generation=row[2],
+            built_at=row[3]
+        )
+
+    def save(self, profile: UserProfile):
+        items = json.dumps({
+            "purchase_window": profile.purchase_window,
+            "view_window": profile.view_window,
+            "category": profile.category,
+            "category_products": profile.category_products,
+            "purchased": profile.purchased,
+            "viewed": profile.viewed,
+        })
+        blob = profile.vector_sum.astype(np.float32).tobytes() if profile.vector_sum is not None else None
+        self.connections.get().execute(
+            "INSERT OR REPLACE INTO user_profiles (user_id, items, vector_sum, generation, built_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (profile.user_id, items, blob, profile.generation, profile.built_at)
+        )
+
+    def delete(self, user_id: int):
+        self.connections.get().execute("DELETE FROM user_profiles WHERE user_id = ?", (user_id,))
+
+    def transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT, so concurrent updates to a profile serialize."""
+        return self.connections.transaction()
+
+
+store = ProfileStore()
+
+
+def build_profile(user_id: int, activity: Optional[UserActivity] = None) -> UserProfile:
+    """Seed a profile from MySQL activity (product selection of get_top_representative_products)."""
+    if activity is None:
+        activity = fetch_user_activity(user_id)
+
+    category = activity.top_view_category()
+    profile = UserProfile(
+        user_id=user_id,
+        purchase_window=activity.purchases[:MAX_RECENT_PURCHASES],
+        view_window=activity.views[:MAX_RECENT_VIEWS],
+        category=category,
+        category_products=get_category_products(category, MAX_FALLBACK_CANDIDATES) if category is not None else [],
+        purchased=list(dict.fromkeys(activity.purchases)),
+        built_at=time.time()
+    )
+    candidates = profile.candidates()
+    profile.viewed = [pid for pid in dict.fromkeys(activity.views) if pid in candidates]
+    profile.resum()
+    return profile
+
+
+def get_profile_vector(user_id: int, activity: Optional[UserActivity] = None) -> Optional[np.ndarray]:
+    """
+    Return the user's profile vector, building and storing it on first use.
+
+    Args:
+        user_id: User ID
+        activity: Preloaded activity snapshot; a stored profile that doesn't match it is rebuilt from it
+
+    Returns:
+        Normalised profile vector, or None if the user has no usable activity
+    """
+    with metrics.span("profile.load"):
+        profile = store.get(user_id)
+    if _pending_update(profile, activity) is None:
+        return profile.vector()
+
+    # Re-read under the write lock, so an interaction applied meanwhile is
+    # neither overwritten nor lost
+    with store.transaction():
+        profile = store.get(user_id)
+        update = _pending_update(profile, activity)
+        if update == "build":
+            metrics.count("profile_builds")
+            with metrics.span("profile.build"):
+                profile = build_profile(user_id, activity)
+                if profile.vector_sum is None:
+                    return None
+                store.save(profile)
+        elif update == "resum":
+            # Catalog changed since the sum was computed: re-sum from stored vectors
+            with metrics.span("profile.resum"):
+                profile.resum()
+                store.save(profile)
+
+    return profile.vector()
+
+
+def _pending_update(profile: Optional[UserProfile], activity: Optional[UserActivity]) -> Optional[str]:
+    """"build" if the profile must be (re)built from MySQL, "resum" if its sum is stale, else None."""
+    if profile is None or time.time() - profile.built_at > PROFILE_REBUILD_AFTER:
+        return "build"
+    if activity is not None and not profile.matches(activity):
+        metrics.count("profile_mismatches")
+        return "build"
+    if profile.generation != rec_cache.state.sync_generation():
+        return "resum"
+    return None
+
+
+def apply_interaction(user_id: int, product_id: int, kind: str) -> bool:
+    """
+    Fold one new view or purchase into a stored profile.
+
+    Costs a handful of vector additions: the event is added to its window
+    as MySQL would return it, and the item weights before and after are
+    diffed, so the new item is added, whatever it displaces (an older
+    view/purchase leaving the window, or a category fallback product) is
+    subtracted, and an item whose type changed is reweighted. A change of
+    the most viewed category is picked up when the profile is next read.
+
+    Args:
+        user_id: User ID
+        product_id: Product that was viewed or purchased
+        kind: "view" or "purchase"
+
+    Returns:
+        True if a stored profile was updated, False if the user has none yet
+        (it will be built from MySQL on the next request)
+    """
+    if kind not in ("view", "purchase"):
+        raise ValueError(f"Unknown interaction type: {kind}")
+
+    vectors = get_product_vectors([product_id])
+    if product_id not in vectors:
+        return False
+
+    with store.transaction():
+        profile = store.get(user_id)
+        if profile is None or profile.vector_sum is None:
+            return False
+
+        before = dict(profile.items())
+
+        if kind == "purchase":
+            profile.purchase_window.insert(0, product_id)
+            del profile.purchase_window[MAX_RECENT_PURCHASES:]
+            if product_id not in profile.purchased:
+                profile.purchased.append(product_id)
+        else:
+            profile.view_window.insert(0, product_id)
+            del profile.view_window[MAX_RECENT_VIEWS:]
+            if product_id not in profile.purchased and product_id not in profile.viewed:
+                profile.viewed.append(product_id)
+        profile.prune_history()
+
+        # Apply the weight change of every item that was added, removed or reweighted
+        after = dict(profile.items())
+        changes = [
+            (pid, after.get(pid, 0.0) - before.get(pid, 0.0))
+            for pid in before.keys() | after.keys()
+            if after.get(pid, 0.0) != before.get(pid, 0.0)
+        ]
+        other_ids = [pid for pid, _ in changes if pid != product_id]
+        if other_ids:
+            vectors.update(get_product_vectors(other_ids))
+        for pid, delta in changes:
+            if pid in vectors:
+                profile.vector_sum = profile.vector_sum + delta * np.asarray(vectors[pid], dtype=np.float32)
+
+        store.save(profile)
+
+    return True
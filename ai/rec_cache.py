@@ -0,0 +1,246 @@
+# rec_cache.py
+"""
+Cache for /recommend responses.
+
+Product results are keyed by (product_id, k) and the current sync
+generation, so every sync that changes the catalog invalidates them.
+User results are additionally keyed by a per-user version that is bumped
+whenever the user views or buys something. Entries also expire after a TTL.
+
+The cache lives in process (LRU) unless REDIS_URL is set, in which case a
+Redis-compatible server is shared by all workers. Without Redis the sync
+generation and user versions are still shared by all workers on the host
+(through a file and a SQLite database), so an invalidation handled by one
+worker reaches the entries cached by the others.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from storage import FileWatch, SQLiteConnections, write_atomic
+
+try:
+    import redis
+except ImportError:  # optional dependency
+    redis = None
+
+CACHE_MAX_ENTRIES = int(os.getenv("REC_CACHE_MAX_ENTRIES", "10000"))
+PRODUCT_TTL = float(os.getenv("REC_CACHE_PRODUCT_TTL", "3600"))
+USER_TTL = float(os.getenv("REC_CACHE_USER_TTL", "300"))
+REDIS_URL = os.getenv("REDIS_URL")
+
+GENERATION_FILE = os.getenv(
+    "SYNC_GENERATION_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "sync_generation")
+)
+USER_VERSIONS_DB = os.getenv(
+    "USER_VERSIONS_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "user_versions.sqlite3")
+)
+
+# A user version is forgotten once every entry cached under it has expired
+USER_VERSION_RETENTION = 2 * USER_TTL
+
+
+class LRUCache:
+    """Thread-safe LRU with per-entry TTL."""
+
+    def __init__(self, maxsize: int = CACHE_MAX_ENTRIES):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._data)
+
+
+class LocalState:
+    """
+    Sync generation (shared via a file) and per-user versions (shared via
+    SQLite) for the workers of one host.
+
+    A user version is the time of the user's last invalidation in ns, so a
+    pruned user falls back to version 0 without reusing a live key.
+    """
+
+    def __init__(self, generation_file: str = GENERATION_FILE, versions_db: str = USER_VERSIONS_DB):
+        self.generation_file = generation_file
+        self._watch = FileWatch(generation_file)
+        self._generation = 0
+        self.connections = SQLiteConnections(versions_db)
+        self.connections.get().execute("""
+            CREATE TABLE IF NOT EXISTS user_versions (
+                user_id INTEGER PRIMARY KEY,
+                version INTEGER NOT NULL
+            )
+        """)
+        self.connections.get().execute(
+            "CREATE INDEX IF NOT EXISTS user_versions_version ON user_versions (version)"
+        )
+
+    def _load_generation(self):
+        with open(self.generation_file) as f:
+            self._generation = int(f.read().strip() or 0)
+
+    def sync_generation(self) -> int:
+        self._watch.refresh(self._load_generation)
+        return self._generation
+
+    def bump_sync_generation(self):
+        write_atomic(self.generation_file, str(self.sync_generation() + 1))
+
+    def user_version(self, user_id: int) -> int:
+        row = self.connections.get().execute(
+            "SELECT version FROM user_versions WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def bump_user_version(self, user_id: int):
+        now = time.time_ns()
+        with self.connections.transaction() as conn:
+            conn.execute(
+                "INSERT INTO user_versions (user_id, version) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET version = MAX(version + 1, excluded.version)",
+                (user_id, now)
+            )
+            conn.execute(
+                "DELETE FROM user_versions WHERE version < ?",
+                (now - int(USER_VERSION_RETENTION * 1e9),)
+            )
+
+
+class RedisState:
+    """Sync generation, per-user versions and cached entries kept in Redis."""
+
+    def __init__(self, url: str):
+        self.client = redis.Redis.from_url(url)
+
+    def sync_generation(self) -> int:
+        return int(self.client.get("rec:sync_generation") or 0)
+
+    def bump_sync_generation(self):
+        self.client.incr("rec:sync_generation")
+
+    def user_version(self, user_id: int) -> int:
+        return int(self.client.get(f"rec:user_version:{user_id}") or 0)
+
+    def bump_user_version(self, user_id: int):
+        key = f"rec:user_version:{user_id}"
+        # Expires after every entry cached under it; the count then restarts
+        # from 0, but no live entry is left under the old numbers
+        with self.client.pipeline() as pipe:
+            pipe.incr(key)
+            pipe.expire(key, int(USER_VERSION_RETENTION))
+            pipe.execute()
+
+    def get(self, key):
+        raw = self.client.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl: float):
+        self.client.setex(key, int(ttl), json.dumps(value))
+
+
+class RecommendationCache:
+
+    def __init__(self, redis_url: str = REDIS_URL):
+        if redis_url and redis is not None:
+            self.state = RedisState(redis_url)
+            self.store = self.state
+            self.backend = "redis"
+        else:
+            self.state = LocalState()
+            self.store = LRUCache()
+            self.backend = "memory"
+
+        self._lock = threading.Lock()
+        self._stats = {
+            "product_hits": 0,
+            "product_misses": 0,
+            "user_hits": 0,
+            "user_misses": 0,
+            "user_invalidations": 0,
+        }
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def product_key(self, product_id: int, k: int) -> str:
+        """
+        Cache key for a product result under the current sync generation.
+        Take it before computing the result and store under the same key,
+        so a result computed across a sync is never filed under the new
+        generation.
+        """
+        return f"rec:product:{self.state.sync_generation()}:{product_id}:{k}"
+
+    def user_key(self, user_id: int, k: int) -> str:
+        """Cache key for a user result under the current generation and user version (see product_key)."""
+        generation = self.state.sync_generation()
+        version = self.state.user_version(user_id)
+        return f"rec:user:{generation}:{user_id}:{version}:{k}"
+
+    def get_product(self, key: str):
+        value = self.store.get(key)
+        self._count("product_hits" if value is not None else "product_misses")
+        return value
+
+    def set_product(self, key: str, result):
+        self.store.set(key, result, PRODUCT_TTL)
+
+    def get_user(self, key: str):
+        value = self.store.get(key)
+        self._count("user_hits" if value is not None else "user_misses")
+        return value
+
+    def set_user(self, key: str, result):
+        self.store.set(key, result, USER_TTL)
+
+    def invalidate_user(self, user_id: int):
+        """Drop cached results for a user (call after a view or purchase)."""
+        self.state.bump_user_version(user_id)
+        self._count("user_invalidations")
+
+    def bump_sync_generation(self):
+        """Drop all cached results (call after a sync changed the catalog)."""
+        self.state.bump_sync_generation()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        for kind in ("product", "user"):
+            total = stats[f"{kind}_hits"] + stats[f"{kind}_misses"]
+            stats[f"{kind}_hit_rate"] = stats[f"{kind}_hits"] / total if total else 0.0
+        stats["backend"] = self.backend
+        stats["sync_generation"] = self.state.sync_generation()
+        if isinstance(self.store, LRUCache):
+            stats["entries"] = len(self.store)
+            stats["evictions"] = self.store.evictions
+        return stats
+
+
+cache = RecommendationCache()
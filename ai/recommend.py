@@ -1,77 +1,115 @@
-from qdrant_client import QdrantClient
-from qdrant_client.http import models as qmodels
-from embedder import embed_text
-from sync_products import fetch_product, fetch_products_batch
-from user_profile import build_user_profile_vector, get_user_interacted_products, fetch_user_activity
-import json
+from embedder import embed_batch
+from sync_products import fetch_products_batch, build_product_text
+from user_profile import fetch_user_activity, fetch_user_activity_batch, UserActivity
+from profile_store import get_profile_vector
+from tag_dictionary import tag_dictionary, parse_tags
+from reranker import (
+    Candidates, TagVocabulary, apply_category_preference, category_array, shared_tag_counts, top_k
+)
+from search_backend import SearchQuery, load_search_backend
+from covisitation import COVISITATION_WEIGHT, model as covisitation
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional, Set
 import numpy as np
+import metrics
 
-QDRANT_URL = "http://127.0.0.1:6333"
-COLLECTION_NAME = "products"
+if TYPE_CHECKING:
+    from qdrant_client.http import models as qmodels
 
-client = QdrantClient(url=QDRANT_URL)
+# Qdrant server or in-process index, chosen by SEARCH_BACKEND
+backend = load_search_backend()
 
+PRODUCT_SEARCH_LIMIT = 30   # candidates fetched for product-to-product reranking
+CATEGORY_SEARCH_LIMIT = 20  # candidates per preferred category in the user fallback search
+USER_RERANK_MARGIN = 40     # extra candidates beyond k fetched for user reranking
 
-def recommend_for_product(product_id: int, k: int = 10):
-    product = fetch_product(product_id)
-    if not product:
-        return []
+# Payload fields returned by searches (display fields + what reranking reads)
+SEARCH_PAYLOAD_FIELDS = ["id", "name", "price", "image_url", "category_id", "category_name", "tag_ids"]
+# Payload fields needed from a stored point used as a product query
+QUERY_PAYLOAD_FIELDS = ["category_id", "tag_ids"]
+
+
+def product_tag_ids(product: dict) -> List[int]:
+    """Tag ids of a stored payload, or of a MySQL row via the sync tag dictionary."""
+    if "tag_ids" in product:
+        return product["tag_ids"] or []
+    return tag_dictionary.ids(parse_tags(product.get("tags")))
+
+
+def fetch_stored_points(product_ids: List[int]) -> dict:
+    """
+    Fetch the vectors and payloads stored for products during sync.
 
-    # Build combined text
-    combined = f"{product['name']} {product['description']} {product['category_name']} "
+    Args:
+        product_ids: Product IDs (also the Qdrant point ids)
 
+    Returns:
+        Dictionary mapping product_id -> (vector, payload) for indexed products
+    """
     try:
-        tags = json.loads(product["tags"]) if isinstance(product["tags"], str) else product["tags"]
-        combined_tags = tags
-        combined += " ".join(tags)
-    except:
-        combined_tags = []
-        pass
+        points = backend.retrieve(product_ids, QUERY_PAYLOAD_FIELDS)
+    except Exception:
+        return {}
 
-    vector = embed_text(combined).tolist()
+    return {int(p.id): (p.vector, p.payload) for p in points}
 
-    # Fetch more results (for reranking)
-    raw_results = client.search(
-        collection_name=COLLECTION_NAME,
-        query_vector=vector,
-        limit=30,
-        with_payload=True
-    )
 
-    boosted = []
+def resolve_product_queries(product_ids: List[int]) -> dict:
+    """
+    Get the query vector and product data for each product.
 
-    for r in raw_results:
-        if r.payload["id"] == product_id:
-            continue
+    Reuses the vectors stored by sync_products; products that are not synced
+    yet are loaded from MySQL and embedded in one batch.
 
-        score = r.score
+    Returns:
+        Dictionary mapping product_id -> (vector, product) for products that exist
+    """
+    queries = fetch_stored_points(product_ids)
 
-        # --- Category Boost ---
-        if r.payload["category_name"] == product["category_name"]:
-            score += 0.20   # 20% boost
+    missing = [pid for pid in product_ids if pid not in queries]
+    if missing:
+        products = fetch_products_batch(missing)
+        missing = [pid for pid in missing if pid in products]
+        if missing:
+            vectors = embed_batch([build_product_text(products[pid]) for pid in missing])
+            for pid, vec in zip(missing, vectors):
+                queries[pid] = (vec.tolist(), products[pid])
 
-        # --- Tag Boost ---
-        try:
-            r_tags = json.loads(r.payload["tags"])
-        except:
-            r_tags = []
+    return queries
 
-        shared_tags = set(combined_tags).intersection(set(r_tags))
-        score += 0.10 * len(shared_tags)
 
-        boosted.append((score, r))
+def hit_candidates(hits, vocab: TagVocabulary) -> Candidates:
+    return Candidates.from_hits(hits, vocab, lambda payload: payload.get("tag_ids") or [])
 
-    # Sort again after boosting
-    boosted_sorted = sorted(boosted, key=lambda x: x[0], reverse=True)
 
-    final = boosted_sorted[:k]
+def rerank_product_hits(product_id: int, product: dict, raw_results, k: int):
+    product_tags = product_tag_ids(product)
+    vocab = TagVocabulary([product_tags])
+
+    candidates = hit_candidates(raw_results, vocab)
+    candidates = candidates.select(np.flatnonzero(candidates.ids != product_id))
+
+    scores = candidates.scores.copy()
+
+    # --- Category Boost ---
+    product_category = category_array([product.get("category_id")])[0]
+    scores += 0.20 * (candidates.category_ids == product_category)   # 20% boost
+
+    # --- Tag Boost ---
+    scores += 0.10 * shared_tag_counts(candidates.tag_bits, vocab.encode([product_tags])[0])
+
+    # --- Co-visitation Boost (users who interacted with this product also did with...) ---
+    scores += COVISITATION_WEIGHT * covisitation.scores([product_id], [1.0], candidates.ids)
+
+    # Sort again after boosting
+    final = candidates.entries(scores, top_k(scores, k))
 
     return {
         "product_id": product_id,
         "recommendations": [
             {
                 "id": entry[1].payload["id"],
-                "score": float(entry[0]),
+                "score": entry[0],
                 "payload": entry[1].payload
             }
             for entry in final
@@ -79,18 +117,280 @@ def recommend_for_product(product_id: int, k: int = 10):
     }
 
 
-def recommend_for_user(user_id: int, k: int = 10):
+def recommend_for_product(product_id: int, k: int = 10, params: Optional["qmodels.SearchParams"] = None):
+    # Reuse the vector stored by sync_products instead of re-embedding
+    with metrics.span("product.resolve_query"):
+        query = resolve_product_queries([product_id]).get(product_id)
+    if not query:
+        return []
+    vector, product = query
+
+    # Fetch more results (for reranking)
+    raw_results = backend.search(
+        [SearchQuery(vector=vector, limit=PRODUCT_SEARCH_LIMIT)], SEARCH_PAYLOAD_FIELDS, params
+    )[0]
+
+    with metrics.span("product.rerank"):
+        return rerank_product_hits(product_id, product, raw_results, k)
+
+
+def recommend_for_products(product_ids: List[int], k: int = 10,
+                           params: Optional["qmodels.SearchParams"] = None) -> list:
+    """
+    Product-to-product recommendations for many products in one pass.
+
+    Stored vectors are retrieved in one call and all searches go to the
+    search backend as a single batch.
+
+    Returns:
+        One result per product id, in input order ([] for unknown products)
+    """
+    queries = resolve_product_queries(product_ids)
+    found = [pid for pid in product_ids if pid in queries]
+
+    batch_results = backend.search(
+        [SearchQuery(vector=queries[pid][0], limit=PRODUCT_SEARCH_LIMIT) for pid in found],
+        SEARCH_PAYLOAD_FIELDS, params
+    )
+
+    results = {
+        pid: rerank_product_hits(pid, queries[pid][1], raw_results, k)
+        for pid, raw_results in zip(found, batch_results)
+    }
+    return [results.get(pid, []) for pid in product_ids]
+
+
+@dataclass
+class UserContext:
+    """Everything the user reranking needs, computed once per user."""
+    user_id: int
+    vector: np.ndarray
+    interacted: Set[int]
+    user_categories: Dict[int, float]   # category_id -> weight (higher for purchases)
+    preferred_category_ids: List[int]   # sorted by weight, highest first
+    user_tags: Set[int]                 # tag ids
+    covisitation_seeds: Dict[int, float]  # product_id -> weight (recent purchases 2.0, views 1.0)
+
+    def tag_vocabulary(self) -> TagVocabulary:
+        return TagVocabulary([self.user_tags])
+
+    def boost(self, candidates: Candidates, vocab: TagVocabulary):
+        """
+        Boosted scores for candidates.
+
+        Preferred categories get score * (1.0x to 2.5x by normalized category
+        weight) + 0.3, so they rank much higher; every shared tag adds 0.15,
+        and co-visitation with the user's recent products adds up to
+        COVISITATION_WEIGHT.
+
+        Returns:
+            (boosted scores, mask of candidates in a preferred category)
+        """
+        scores, preferred = apply_category_preference(
+            candidates.scores, candidates.category_ids, self.user_categories, scale=1.5, fixed_boost=0.3
+        )
+        scores += 0.15 * shared_tag_counts(candidates.tag_bits, vocab.encode([self.user_tags])[0])
+        scores += COVISITATION_WEIGHT * covisitation.scores(
+            self.covisitation_seeds.keys(), self.covisitation_seeds.values(), candidates.ids
+        )
+        return scores, preferred
+
+
+def user_product_ids(activity: UserActivity) -> List[int]:
+    # Top products used for category / tag preferences
+    return list(set(activity.purchases[:5] + activity.views[:10]))
+
+
+def build_user_context(user_id: int, activity: UserActivity, user_products: dict) -> Optional[UserContext]:
+    """Profile vector, exclusions and category/tag preferences for a user, or None without activity."""
+    user_vector = get_profile_vector(user_id, activity=activity)
+    if user_vector is None:
+        return None
+
+    # Pre-compute user categories and tags with weights
+    user_categories = {}  # category_id -> weight (higher for purchases)
+    user_tags = set()
+    covisitation_seeds = {}
+
+    # Process purchases (higher weight)
+    for pid in activity.purchases[:5]:
+        covisitation_seeds[pid] = covisitation_seeds.get(pid, 0) + 2.0
+        if pid in user_products:
+            prod = user_products[pid]
+            if prod.get('category_id'):
+                # Purchases get weight 2.0
+                user_categories[prod['category_id']] = user_categories.get(prod['category_id'], 0) + 2.0
+            user_tags.update(product_tag_ids(prod))
+
+    # Process views (lower weight)
+    for pid in activity.views[:10]:
+        covisitation_seeds[pid] = covisitation_seeds.get(pid, 0) + 1.0
+        if pid in user_products:
+            prod = user_products[pid]
+            if prod.get('category_id'):
+                # Views get weight 1.0
+                user_categories[prod['category_id']] = user_categories.get(prod['category_id'], 0) + 1.0
+
+    # Get top preferred categories (sorted by weight)
+    preferred_categories = sorted(user_categories.items(), key=lambda x: x[1], reverse=True)
+
+    return UserContext(
+        user_id=user_id,
+        vector=user_vector,
+        interacted=activity.interacted,
+        user_categories=user_categories,
+        preferred_category_ids=[cat_id for cat_id, _ in preferred_categories],
+        user_tags=user_tags,
+        covisitation_seeds=covisitation_seeds
+    )
+
+
+def user_search_limit(k: int) -> int:
+    # Interacted products are excluded by the search itself, so every hit is a usable
+    # candidate: fetch k plus a margin for the category / tag reranking
+    return k + max(k, USER_RERANK_MARGIN)
+
+
+def user_search_query(ctx: UserContext, k: int) -> SearchQuery:
+    """Main search for a user: profile vector, products already interacted with excluded."""
+    return SearchQuery(vector=ctx.vector, limit=user_search_limit(k), exclude_ids=sorted(ctx.interacted))
+
+
+def rerank_user_hits(ctx: UserContext, raw_results, k: int):
+    """
+    Apply boosting (interacted products are already excluded by the query
+    filter; the check here only guards against stale ids).
+
+    Returns:
+        (preferred_category_results, other_results), each the top k
+        (score, hit) pairs sorted by boosted score
+    """
+    vocab = ctx.tag_vocabulary()
+    candidates = hit_candidates(raw_results, vocab)
+
+    # Skip products user already interacted with
+    if ctx.interacted:
+        candidates = candidates.select(
+            np.flatnonzero(~np.isin(candidates.ids, np.fromiter(ctx.interacted, dtype=np.int64)))
+        )
+
+    scores, preferred = ctx.boost(candidates, vocab)
+
+    # Separate results by category
+    return (
+        candidates.entries(scores, top_k(scores, k, mask=preferred)),
+        candidates.entries(scores, top_k(scores, k, mask=~preferred))
+    )
+
+
+def needs_category_fallback(ctx: UserContext, preferred_category_results: list, k: int) -> bool:
+    # Preferred categories are not well-represented in the main search
+    return len(preferred_category_results) < k * 0.5 and bool(ctx.preferred_category_ids)
+
+
+def category_fallback_queries(ctx: UserContext) -> list:
+    """One category-filtered search per top preferred category (up to 3)."""
+    return [
+        (preferred_cat_id, SearchQuery(
+            vector=ctx.vector,
+            limit=CATEGORY_SEARCH_LIMIT,
+            category_id=preferred_cat_id,
+            exclude_ids=sorted(ctx.interacted)
+        ))
+        for preferred_cat_id in ctx.preferred_category_ids[:3]  # Top 3 preferred categories
+    ]
+
+
+def merge_category_fallback(ctx: UserContext, preferred_category_results: list, other_results: list,
+                            filtered_results) -> None:
+    """Add category-filtered hits that aren't already included and aren't excluded."""
+    vocab = ctx.tag_vocabulary()
+    hits = [r for _, category_hits in filtered_results for r in category_hits]
+    if not hits:
+        return
+    candidates = hit_candidates(hits, vocab)
+
+    # First occurrence of each product, in search order
+    _, first = np.unique(candidates.ids, return_index=True)
+    first.sort()
+    excluded = [entry[1].payload["id"] for entry in preferred_category_results + other_results]
+    excluded.extend(ctx.interacted)
+    keep = first[~np.isin(candidates.ids[first], np.array(excluded, dtype=np.int64))]
+    candidates = candidates.select(keep)
+
+    # Apply same boosting
+    scores, _ = ctx.boost(candidates, vocab)
+    preferred_category_results.extend(candidates.entries(scores, np.arange(len(candidates))))
+
+
+def select_user_results(preferred_category_results: list, other_results: list, k: int) -> list:
+    # Prioritize preferred category results: take 80% from preferred, 20% from others
+    preferred_count = min(len(preferred_category_results), int(k * 0.8))
+    other_count = k - preferred_count
+
+    final_results = preferred_category_results[:preferred_count] + other_results[:other_count]
+
+    # If we don't have enough preferred category results, use what we have
+    if len(final_results) < k:
+        remaining = k - len(final_results)
+        # Add more from preferred first, then others
+        if len(preferred_category_results) > preferred_count:
+            final_results.extend(preferred_category_results[preferred_count:preferred_count + remaining])
+            remaining = k - len(final_results)
+        if remaining > 0 and len(other_results) > other_count:
+            final_results.extend(other_results[other_count:other_count + remaining])
+
+    # Final sort by score
+    return sorted(final_results, key=lambda x: x[0], reverse=True)[:k]
+
+
+def user_response(user_id: int, final_results: list) -> dict:
+    return {
+        "user_id": user_id,
+        "source": "user-profile",
+        "recommendations": [
+            {
+                "id": entry[1].payload["id"],
+                "score": entry[0],
+                "payload": entry[1].payload
+            }
+            for entry in final_results
+        ]
+    }
+
+
+def no_activity_response(user_id: int) -> dict:
+    # No user activity - return empty recommendations
+    return {
+        "user_id": user_id,
+        "source": "user-profile",
+        "message": "No user activity found. Please browse or purchase products to get recommendations.",
+        "recommendations": []
+    }
+
+
+def error_response(user_id: int, e: Exception) -> dict:
+    return {
+        "user_id": user_id,
+        "source": "user-profile",
+        "error": str(e),
+        "recommendations": []
+    }
+
+
+def recommend_for_user(user_id: int, k: int = 10, params: Optional["qmodels.SearchParams"] = None):
     """
     Generate personalized recommendations for a user based on their activity.
-    
+
     Uses a hybrid approach:
     1. Content-based: Build user profile vector from viewed/purchased products
-    2. Collaborative: (Future extension - find similar users)
-    
+    2. Collaborative: Boost candidates co-visited with the user's recent products
+
     Args:
         user_id: User ID
         k: Number of recommendations to return
-        
+        params: Qdrant search parameters (default: search_backend.search_params())
+
     Returns:
         {
             "user_id": int,
@@ -102,218 +402,118 @@ def recommend_for_user(user_id: int, k: int = 10):
         }
     """
     try:
-        # 1. Build user profile vector from activity
-        user_vector = build_user_profile_vector(user_id, max_products=10)
-        
-        if user_vector is None:
-            # No user activity - return empty recommendations
-            return {
-                "user_id": user_id,
-                "source": "user-profile",
-                "message": "No user activity found. Please browse or purchase products to get recommendations.",
-                "recommendations": []
-            }
-        
-        # 2. Get products user has already interacted with (to exclude)
-        interacted_products = get_user_interacted_products(user_id)
-        
-        # 3. Fetch user activity and compute preferred categories
-        activity = fetch_user_activity(user_id)
-        
-        # Pre-fetch user's product data in batch for optimization
-        user_product_ids = list(set(activity['purchases'][:5] + activity['views'][:10]))  # Top products
-        user_products = fetch_products_batch(user_product_ids) if user_product_ids else {}
-        
-        # Pre-compute user categories and tags with weights
-        user_categories = {}  # category_id -> weight (higher for purchases)
-        user_tags = set()
-        
-        # Process purchases (higher weight)
-        for pid in activity['purchases'][:5]:
-            if pid in user_products:
-                prod = user_products[pid]
-                if prod.get('category_id'):
-                    # Purchases get weight 2.0
-                    user_categories[prod['category_id']] = user_categories.get(prod['category_id'], 0) + 2.0
-                try:
-                    tags = json.loads(prod["tags"]) if isinstance(prod["tags"], str) else prod.get("tags", [])
-                    user_tags.update(tags)
-                except:
-                    pass
-        
-        # Process views (lower weight)
-        for pid in activity['views'][:10]:
-            if pid in user_products:
-                prod = user_products[pid]
-                if prod.get('category_id'):
-                    # Views get weight 1.0
-                    user_categories[prod['category_id']] = user_categories.get(prod['category_id'], 0) + 1.0
-        
-        # Get top preferred categories (sorted by weight)
-        preferred_categories = sorted(user_categories.items(), key=lambda x: x[1], reverse=True)
-        preferred_category_ids = set([cat_id for cat_id, _ in preferred_categories])
-        
-        # 4. Search Qdrant with user profile vector
-        # Increase search limit significantly to ensure we get products from all categories
-        search_limit = max(k * 5, 100)  # Get 5x results or at least 100
-        
-        raw_results = client.search(
-            collection_name=COLLECTION_NAME,
-            query_vector=user_vector.tolist(),
-            limit=search_limit,
-            with_payload=True
-        )
-        
-        # 5. Filter out interacted products and apply boosting
-        boosted = []
-        
-        for r in raw_results:
-            product_id = r.payload["id"]
-            
-            # Skip products user already interacted with
-            if product_id in interacted_products:
-                continue
-            
-            score = float(r.score)
-            product_category_id = r.payload.get("category_id")
-            
-            # --- Strong Category Boost (if user has viewed/purchased from this category) ---
-            if product_category_id in preferred_category_ids:
-                # Get category weight (normalized)
-                category_weight = user_categories.get(product_category_id, 1.0)
-                max_weight = max(user_categories.values()) if user_categories else 1.0
-                normalized_weight = category_weight / max_weight if max_weight > 0 else 1.0
-                
-                # Apply stronger boost: multiply score by category preference
-                # This ensures preferred categories rank much higher
-                category_multiplier = 1.0 + (normalized_weight * 1.5)  # 1.0x to 2.5x multiplier
-                score = score * category_multiplier
-                
-                # Additional fixed boost for preferred categories
-                score += 0.3  # Strong boost for preferred categories
-            
-            # --- Tag Boost (if product shares tags with user's preferred products) ---
+        # 1. Load user activity once and share it across all profile helpers
+        with metrics.span("user.fetch_activity"):
+            activity = fetch_user_activity(user_id)
+
+        # 2. Profile vector, exclusions and preferred categories / tags
+        product_ids = user_product_ids(activity)
+        with metrics.span("user.fetch_products"):
+            user_products = fetch_products_batch(product_ids) if product_ids else {}
+        with metrics.span("user.build_context"):
+            ctx = build_user_context(user_id, activity, user_products)
+
+        if ctx is None:
+            return no_activity_response(user_id)
+
+        # 3. Search with user profile vector (interacted products excluded in the query)
+        raw_results = backend.search([user_search_query(ctx, k)], SEARCH_PAYLOAD_FIELDS, params)[0]
+
+        # 4. Filter out interacted products and apply boosting
+        with metrics.span("user.rerank"):
+            preferred_category_results, other_results = rerank_user_hits(ctx, raw_results, k)
+
+        # 5. If preferred categories are not well-represented, do a category-specific search
+        if needs_category_fallback(ctx, preferred_category_results, k):
+            # One batch request covers all preferred categories
+            queries = category_fallback_queries(ctx)
             try:
-                r_tags = json.loads(r.payload["tags"]) if isinstance(r.payload["tags"], str) else r.payload.get("tags", [])
-                shared_tags = set(r_tags).intersection(user_tags)
-                if shared_tags:
-                    score += 0.15 * len(shared_tags)  # 15% per shared tag
-            except:
-                pass
-            
-            boosted.append((score, r))
-        
-        # 6. Sort by boosted score (high to low)
-        boosted_sorted = sorted(boosted, key=lambda x: x[0], reverse=True)
-        
-        # 7. Ensure preferred categories are well-represented
-        # Separate results by category
-        preferred_category_results = []
-        other_results = []
-        
-        for entry in boosted_sorted:
-            product_category_id = entry[1].payload.get("category_id")
-            if product_category_id in preferred_category_ids:
-                preferred_category_results.append(entry)
-            else:
-                other_results.append(entry)
-        
-        # If preferred categories are not well-represented, do a category-specific search
-        if len(preferred_category_results) < k * 0.5 and preferred_category_ids:
-            # Search specifically for products in preferred categories
-            
-            for preferred_cat_id in list(preferred_category_ids)[:3]:  # Top 3 preferred categories
-                try:
-                    # Search with category filter
-                    filtered_results = client.search(
-                        collection_name=COLLECTION_NAME,
-                        query_vector=user_vector.tolist(),
-                        query_filter=qmodels.Filter(
-                            must=[
-                                qmodels.FieldCondition(
-                                    key="category_id",
-                                    match=qmodels.MatchValue(value=preferred_cat_id)
-                                )
-                            ]
-                        ),
-                        limit=20,
-                        with_payload=True
-                    )
-                    
-                    # Add filtered results that aren't already included and aren't excluded
-                    for r in filtered_results:
-                        product_id = r.payload["id"]
-                        if product_id not in interacted_products:
-                            # Check if already in results
-                            already_included = any(
-                                entry[1].payload["id"] == product_id 
-                                for entry in preferred_category_results + other_results
-                            )
-                            
-                            if not already_included:
-                                score = float(r.score)
-                                # Apply same boosting
-                                category_weight = user_categories.get(preferred_cat_id, 1.0)
-                                max_weight = max(user_categories.values()) if user_categories else 1.0
-                                normalized_weight = category_weight / max_weight if max_weight > 0 else 1.0
-                                category_multiplier = 1.0 + (normalized_weight * 1.5)
-                                score = score * category_multiplier
-                                score += 0.3
-                                
-                                # Tag boost
-                                try:
-                                    r_tags = json.loads(r.payload["tags"]) if isinstance(r.payload["tags"], str) else r.payload.get("tags", [])
-                                    shared_tags = set(r_tags).intersection(user_tags)
-                                    if shared_tags:
-                                        score += 0.15 * len(shared_tags)
-                                except:
-                                    pass
-                                
-                                preferred_category_results.append((score, r))
-                except Exception as e:
-                    # If filter search fails, continue
-                    pass
-        
-        # Prioritize preferred category results: take 80% from preferred, 20% from others
-        preferred_count = min(len(preferred_category_results), int(k * 0.8))
-        other_count = k - preferred_count
-        
-        final_results = preferred_category_results[:preferred_count] + other_results[:other_count]
-        
-        # If we don't have enough preferred category results, use what we have
-        if len(final_results) < k:
-            remaining = k - len(final_results)
-            # Add more from preferred first, then others
-            if len(preferred_category_results) > preferred_count:
-                final_results.extend(preferred_category_results[preferred_count:preferred_count + remaining])
-                remaining = k - len(final_results)
-            if remaining > 0 and len(other_results) > other_count:
-                final_results.extend(other_results[other_count:other_count + remaining])
-        
-        # Final sort by score
-        final_results = sorted(final_results, key=lambda x: x[0], reverse=True)[:k]
-        
-        # 8. Format response
-        recommendations = [
-            {
-                "id": entry[1].payload["id"],
-                "score": entry[0],
-                "payload": entry[1].payload
-            }
-            for entry in final_results
-        ]
-        
-        return {
-            "user_id": user_id,
-            "source": "user-profile",
-            "recommendations": recommendations
-        }
-        
+                with metrics.span("user.category_fallback"):
+                    hits = backend.search([query for _, query in queries], SEARCH_PAYLOAD_FIELDS, params)
+                    filtered_results = [(cat_id, h) for (cat_id, _), h in zip(queries, hits)]
+                    merge_category_fallback(ctx, preferred_category_results, other_results, filtered_results)
+            except Exception as e:
+                # Fallback search is best effort: keep the main results
+                print(f"⚠️ Category fallback search failed for user {user_id}: {e}")
+
+        # 6. Pick final results and format response
+        with metrics.span("user.select"):
+            return user_response(user_id, select_user_results(preferred_category_results, other_results, k))
+
     except Exception as e:
         # Error handling
-        return {
-            "user_id": user_id,
-            "source": "user-profile",
-            "error": str(e),
-            "recommendations": []
-        }
+        return error_response(user_id, e)
+
+
+def recommend_for_users(user_ids: List[int], k: int = 10,
+                        params: Optional["qmodels.SearchParams"] = None) -> list:
+    """
+    Personalized recommendations for many users in one pass.
+
+    Activity for all users is loaded with one query and their preference
+    products with another; the main searches, and then all category
+    fallback searches, each go to the search backend as a single batch.
+
+    Returns:
+        One response per user id, in input order (same shape as recommend_for_user)
+    """
+    try:
+        with metrics.span("users.fetch_activity"):
+            activities = fetch_user_activity_batch(user_ids)
+
+        all_product_ids = set()
+        for activity in activities.values():
+            all_product_ids.update(user_product_ids(activity))
+        with metrics.span("users.fetch_products"):
+            user_products = fetch_products_batch(list(all_product_ids)) if all_product_ids else {}
+
+        contexts = {}
+        with metrics.span("users.build_context"):
+            for user_id in activities:
+                ctx = build_user_context(user_id, activities[user_id], user_products)
+                if ctx is not None:
+                    contexts[user_id] = ctx
+        searchable = list(contexts.values())
+
+        # All profile vectors in one batch search
+        batch_results = backend.search(
+            [user_search_query(ctx, k) for ctx in searchable], SEARCH_PAYLOAD_FIELDS, params
+        )
+
+        with metrics.span("users.rerank"):
+            reranked = {
+                ctx.user_id: rerank_user_hits(ctx, raw_results, k)
+                for ctx, raw_results in zip(searchable, batch_results)
+            }
+
+        # All category fallback searches in one batch
+        fallback_queries = []
+        for ctx in searchable:
+            if needs_category_fallback(ctx, reranked[ctx.user_id][0], k):
+                fallback_queries.extend(
+                    (ctx.user_id, cat_id, query) for cat_id, query in category_fallback_queries(ctx)
+                )
+        if fallback_queries:
+            fallback_results = backend.search(
+                [query for _, _, query in fallback_queries], SEARCH_PAYLOAD_FIELDS, params
+            )
+            grouped = {}
+            for (user_id, cat_id, _), hits in zip(fallback_queries, fallback_results):
+                grouped.setdefault(user_id, []).append((cat_id, hits))
+            for user_id, filtered_results in grouped.items():
+                preferred_category_results, other_results = reranked[user_id]
+                merge_category_fallback(contexts[user_id], preferred_category_results, other_results, filtered_results)
+
+        responses = []
+        for user_id in user_ids:
+            if user_id not in reranked:
+                responses.append(no_activity_response(user_id))
+            else:
+                preferred_category_results, other_results = reranked[user_id]
+                responses.append(user_response(
+                    user_id, select_user_results(preferred_category_results, other_results, k)
+                ))
+        return responses
+
+    except Exception as e:
+        return [error_response(user_id, e) for user_id in user_ids]
@@ -0,0 +1,138 @@
+# reranker.py
+"""
+Vectorized reranking of vector-search candidates.
+
+Candidates are held as parallel NumPy arrays (similarity scores, category
+ids and packed tag bitsets) so category and tag boosts are applied to the
+whole candidate window at once, and top-k selection uses argpartition.
+"""
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+NO_CATEGORY = -1
+
+# Number of set bits in every byte value
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class TagVocabulary:
+    """Maps tag values to bit positions for the bitsets of one rerank call."""
+
+    def __init__(self, tag_lists: Iterable[Iterable] = ()):
+        self.index: Dict = {}
+        for tags in tag_lists:
+            for tag in tags:
+                self.index.setdefault(tag, len(self.index))
+
+    @property
+    def nbytes(self) -> int:
+        return max(1, (len(self.index) + 7) // 8)
+
+    def encode(self, tag_lists: List[Iterable]) -> np.ndarray:
+        """
+        Packed bitsets of shape (len(tag_lists), nbytes); tags outside the
+        vocabulary are ignored (they can't be shared with the query anyway).
+        """
+        bits = np.zeros((len(tag_lists), self.nbytes * 8), dtype=bool)
+        for row, tags in enumerate(tag_lists):
+            cols = [self.index[tag] for tag in tags if tag in self.index]
+            bits[row, cols] = True
+        return np.packbits(bits, axis=1)
+
+
+def shared_tag_counts(candidate_bits: np.ndarray, query_bits: np.ndarray) -> np.ndarray:
+    """Number of tags each candidate shares with the query bitset."""
+    return _POPCOUNT[candidate_bits & query_bits].sum(axis=1, dtype=np.int32)
+
+
+def category_array(category_ids: Iterable[Optional[int]]) -> np.ndarray:
+    return np.array([NO_CATEGORY if c is None else c for c in category_ids], dtype=np.int64)
+
+
+def category_weight_lookup(category_ids: np.ndarray, category_weights: Dict[int, float]) -> np.ndarray:
+    """Per-candidate category weight (0 for categories without a weight)."""
+    if not category_weights or len(category_ids) == 0:
+        return np.zeros(len(category_ids), dtype=np.float64)
+    unique, inverse = np.unique(category_ids, return_inverse=True)
+    weights = np.array([category_weights.get(int(c), 0.0) for c in unique], dtype=np.float64)
+    return weights[inverse]
+
+
+def apply_category_preference(scores: np.ndarray, category_ids: np.ndarray, category_weights: Dict[int, float],
+                              scale: float = 1.5, fixed_boost: float = 0.3):
+    """
+    Boost candidates from preferred categories:
+    score * (1 + scale * weight / max_weight) + fixed_boost.
+
+    Returns:
+        (boosted scores, boolean mask of preferred-category candidates)
+    """
+    preferred = np.isin(category_ids, np.fromiter(category_weights.keys(), dtype=np.int64, count=len(category_weights))) \
+        if category_weights else np.zeros(len(category_ids), dtype=bool)
+    if not preferred.any():
+        return scores.copy(), preferred
+
+    max_weight = max(category_weights.values())
+    normalized = category_weight_lookup(category_ids, category_weights) / max_weight if max_weight > 0 \
+        else np.ones(len(category_ids))
+    boosted = np.where(preferred, scores * (1.0 + normalized * scale) + fixed_boost, scores)
+    return boosted, preferred
+
+
+@dataclass
+class Candidates:
+    """Search hits as parallel arrays."""
+    hits: list
+    ids: np.ndarray
+    scores: np.ndarray
+    category_ids: np.ndarray
+    tag_bits: np.ndarray
+
+    @classmethod
+    def from_hits(cls, hits, vocab: TagVocabulary, tags_of: Callable[[dict], Iterable]) -> "Candidates":
+        payloads = [h.payload for h in hits]
+        return cls(
+            hits=list(hits),
+            ids=np.array([p["id"] for p in payloads], dtype=np.int64),
+            scores=np.array([h.score for h in hits], dtype=np.float64),
+            category_ids=category_array(p.get("category_id") for p in payloads),
+            tag_bits=vocab.encode([tags_of(p) for p in payloads])
+        )
+
+    def __len__(self):
+        return len(self.hits)
+
+    def select(self, indices: np.ndarray) -> "Candidates":
+        return Candidates(
+            hits=[self.hits[i] for i in indices],
+            ids=self.ids[indices],
+            scores=self.scores[indices],
+            category_ids=self.category_ids[indices],
+            tag_bits=self.tag_bits[indices]
+        )
+
+    def entries(self, scores: np.ndarray, indices: np.ndarray) -> list:
+        """(score, hit) pairs for the given candidate indices."""
+        return [(float(scores[i]), self.hits[i]) for i in indices]
+
+
+def top_k(scores: np.ndarray, k: int, mask: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Indices of the k highest scores (optionally among mask), best first.
+    Ties keep candidate order, like a stable sort.
+    """
+    candidates = np.flatnonzero(mask) if mask is not None else np.arange(len(scores))
+    if k <= 0 or len(candidates) == 0:
+        return candidates[:0]
+    if k < len(candidates):
+        # Everything above the k-th score, then the earliest candidates tied with it
+        candidate_scores = scores[candidates]
+        kth = -np.partition(-candidate_scores, k - 1)[k - 1]
+        keep = candidate_scores > kth
+        ties = np.flatnonzero(candidate_scores == kth)
+        keep[ties[:k - np.count_nonzero(keep)]] = True
+        candidates = candidates[keep]
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order]
@@ -0,0 +1,237 @@
+# search_backend.py
+"""
+Vector search backends for the recommend module.
+
+Both backends take the same SearchQuery objects (vector, limit, optional
+category filter, product ids to exclude) and return hits with .id, .score
+and .payload, best first:
+
+- "qdrant" (default): the Qdrant server behind the "products" alias.
+- "local": brute-force cosine search in process over the memory-mapped
+  vector store that sync_products writes. One BLAS matmul scores a whole
+  batch of queries against every product, and argpartition picks the top
+  k. This saves the network hop on every search, and exact search stays
+  fast for catalogs up to a few hundred thousand products.
+  With SEARCH_BACKEND=local, sync_products writes only the vector store,
+  so no Qdrant server is needed.
+
+qdrant_client is imported only when Qdrant is actually used (it takes
+most of a second), so the local backend and CLI tools start quickly.
+"""
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, List, Optional, Sequence
+
+import numpy as np
+
+import metrics
+from reranker import top_k
+from vector_store import ProductVectorStore, store as vector_store
+
+if TYPE_CHECKING:
+    from qdrant_client import QdrantClient
+    from qdrant_client.http import models as qmodels
+
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "qdrant")  # "qdrant" or "local"
+
+QDRANT_URL = "http://127.0.0.1:6333"
+COLLECTION_NAME = "products"
+
+# Default per-query search parameters. hnsw_ef trades latency for recall
+# (0 = Qdrant's default); with an int8-quantized collection, rescoring
+# re-ranks limit * oversampling quantized hits with the original vectors.
+# Measure with python -m benchmarks.recall.
+SEARCH_HNSW_EF = int(os.getenv("QDRANT_SEARCH_HNSW_EF", "0"))
+SEARCH_RESCORE = os.getenv("QDRANT_SEARCH_RESCORE", "1") == "1"
+SEARCH_OVERSAMPLING = float(os.getenv("QDRANT_SEARCH_OVERSAMPLING", "2.0"))
+
+
+def search_params(hnsw_ef: Optional[int] = None, rescore: Optional[bool] = None,
+                  oversampling: Optional[float] = None, exact: bool = False) -> "qmodels.SearchParams":
+    """Search parameters, falling back to the configured defaults for anything not given."""
+    from qdrant_client.http import models as qmodels
+
+    return qmodels.SearchParams(
+        hnsw_ef=hnsw_ef or SEARCH_HNSW_EF or None,
+        exact=exact,
+        quantization=qmodels.QuantizationSearchParams(
+            rescore=SEARCH_RESCORE if rescore is None else rescore,
+            oversampling=oversampling or SEARCH_OVERSAMPLING
+        )
+    )
+
+
+@dataclass
+class SearchQuery:
+    vector: Sequence[float]
+    limit: int
+    category_id: Optional[int] = None                        # only products in this category
+    exclude_ids: Sequence[int] = field(default_factory=list)  # products never returned
+
+
+@dataclass
+class Hit:
+    id: int
+    score: float
+    payload: dict
+
+
+@dataclass
+class StoredPoint:
+    id: int
+    vector: List[float]
+    payload: dict
+
+
+def _as_list(vector) -> list:
+    return vector.tolist() if isinstance(vector, np.ndarray) else list(vector)
+
+
+class QdrantBackend:
+    name = "qdrant"
+
+    def __init__(self, client: Optional["QdrantClient"] = None, collection_name: str = COLLECTION_NAME):
+        self._client = client
+        self._client_lock = threading.Lock()
+        self.collection_name = collection_name
+
+    @property
+    def client(self) -> "QdrantClient":
+        """The Qdrant client, created (and qdrant_client imported) on first use."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    from qdrant_client import QdrantClient
+
+                    self._client = QdrantClient(url=QDRANT_URL)
+        return self._client
+
+    def _call(self, method: str, **kwargs):
+        """Call a Qdrant client method on the serving collection, timed and counted."""
+        metrics.count("qdrant_calls")
+        with metrics.span(f"qdrant.{method}"):
+            return getattr(self.client, method)(collection_name=self.collection_name, **kwargs)
+
+    @staticmethod
+    def query_filter(query: SearchQuery) -> Optional["qmodels.Filter"]:
+        from qdrant_client.http import models as qmodels
+
+        must = [
+            qmodels.FieldCondition(key="category_id", match=qmodels.MatchValue(value=query.category_id))
+        ] if query.category_id is not None else None
+        must_not = [qmodels.HasIdCondition(has_id=sorted(query.exclude_ids))] if query.exclude_ids else None
+        return qmodels.Filter(must=must, must_not=must_not) if must or must_not else None
+
+    def retrieve(self, product_ids: List[int], payload_fields: List[str]) -> list:
+        points = self._call("retrieve", ids=list(product_ids), with_vectors=True, with_payload=payload_fields)
+        return [p for p in points if p.vector is not None]
+
+    def search(self, queries: List[SearchQuery], payload_fields: List[str],
+               params: Optional["qmodels.SearchParams"] = None) -> list:
+        from qdrant_client.http import models as qmodels
+
+        if not queries:
+            return []
+        params = params or search_params()
+        if len(queries) == 1:
+            query = queries[0]
+            return [self._call(
+                "search",
+                query_vector=_as_list(query.vector),
+                query_filter=self.query_filter(query),
+                limit=query.limit,
+                with_payload=payload_fields,
+                search_params=params
+            )]
+        return self._call(
+            "search_batch",
+            requests=[
+                qmodels.SearchRequest(
+                    vector=_as_list(query.vector),
+                    filter=self.query_filter(query),
+                    limit=query.limit,
+                    with_payload=payload_fields,
+                    params=params
+                )
+                for query in queries
+            ]
+        )
+
+
+class LocalBackend:
+    """Exact cosine search over the memory-mapped vector store (vectors are unit length)."""
+    name = "local"
+
+    def __init__(self, store: ProductVectorStore = vector_store):
+        self.store = store
+
+    def _generation(self):
+        generation = self.store.snapshot()
+        if generation.vectors is not None and generation.payloads is None:
+            raise RuntimeError("The vector store has no payloads yet; run a full sync (POST /sync?full=true)")
+        return generation
+
+    @staticmethod
+    def _select(payload: dict, payload_fields: List[str]) -> dict:
+        return {key: payload[key] for key in payload_fields if key in payload}
+
+    def retrieve(self, product_ids: List[int], payload_fields: List[str]) -> list:
+        with metrics.span("local_index.retrieve"):
+            generation = self._generation()
+            rows = [(pid, generation.index[pid]) for pid in product_ids if pid in generation.index]
+            return [
+                StoredPoint(
+                    id=pid,
+                    vector=np.asarray(generation.vectors[row], dtype=np.float32).tolist(),
+                    payload=self._select(generation.payload(row), payload_fields)
+                )
+                for pid, row in rows
+            ]
+
+    def search(self, queries: List[SearchQuery], payload_fields: List[str],
+               params: Optional["qmodels.SearchParams"] = None) -> list:
+        """params (Qdrant HNSW / quantization settings) do not apply: search is always exact."""
+        if not queries:
+            return []
+        with metrics.span("local_index.search"):
+            generation = self._generation()
+            if not generation.index:
+                return [[] for _ in queries]
+
+            matrix = np.array([np.asarray(query.vector, dtype=np.float32) for query in queries])
+            matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+            # (queries, products) cosine similarities in one BLAS call
+            scores = matrix @ generation.vectors.T
+
+            results = []
+            for query, row_scores in zip(queries, scores):
+                mask = None
+                if query.category_id is not None:
+                    mask = generation.categories == query.category_id
+                excluded = [generation.index[pid] for pid in query.exclude_ids if pid in generation.index]
+                if excluded:
+                    if mask is None:
+                        mask = np.ones(len(row_scores), dtype=bool)
+                    mask[excluded] = False
+                results.append([
+                    Hit(
+                        id=int(generation.ids[row]),
+                        score=float(row_scores[row]),
+                        payload=self._select(generation.payload(row), payload_fields)
+                    )
+                    for row in top_k(row_scores, query.limit, mask)
+                ])
+            return results
+
+
+BACKENDS = {
+    QdrantBackend.name: QdrantBackend,
+    LocalBackend.name: LocalBackend,
+}
+
+
+def load_search_backend(name: str = SEARCH_BACKEND):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown SEARCH_BACKEND: {name}")
+    return BACKENDS[name]()
@@ -1,23 +1,253 @@
 # project/ai/service.py
 
-from fastapi import FastAPI
-from recommend import recommend_for_product, recommend_for_user
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel
+from typing import List, Optional
+from recommend import recommend_for_product, recommend_for_user, recommend_for_products, recommend_for_users
+from search_backend import search_params
 from sync_products import sync_products
+from db_pool import pool_stats, POOL_SIZE
+from rec_cache import cache
+from profile_store import apply_interaction
+from embedder import inference_executor, is_loaded, warm_up
+from embedding_cache import cache as embedding_cache
+import metrics
 
 app = FastAPI()
 
+# Recommendation work (MySQL + Qdrant calls) runs on a dedicated bounded
+# executor instead of the shared request threadpool; embedding runs on the
+# embedder's own inference executor. Sized to the DB pool so requests queue
+# here rather than timing out on a connection checkout.
+REQUEST_WORKERS = int(os.getenv("REQUEST_WORKERS", str(POOL_SIZE)))
+request_executor = ThreadPoolExecutor(max_workers=REQUEST_WORKERS, thread_name_prefix="recommend")
+
+# Load the embedding model at startup instead of on the first request that
+# needs it. Runs in the background, so the server starts accepting requests
+# (health checks, cached and DB-only paths) immediately.
+EMBEDDER_WARMUP = os.getenv("EMBEDDER_WARMUP", "0") == "1"
+
+# /sync runs as a single background job
+sync_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sync")
+sync_lock = threading.Lock()
+sync_status = {
+    "state": "idle",   # idle | running | succeeded | failed
+    "full": None,
+    "started_at": None,
+    "finished_at": None,
+    "error": None,
+}
+
+
+async def run_blocking(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(request_executor, partial(fn, *args, **kwargs))
+
+
+def run_sync_job(full: bool):
+    try:
+        with metrics.span("sync.job"):
+            sync_products(full=full)
+        state, error = "succeeded", None
+    except Exception as e:
+        state, error = "failed", str(e)
+    with sync_lock:
+        sync_status.update(state=state, error=error, finished_at=datetime.now().isoformat())
+
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    # Label by route template (/recommend/user/{user_id}), not the raw path
+    metrics.request_seconds.observe(getattr(route, "path", "unmatched"), time.perf_counter() - start)
+    return response
+
+
+async def run_with_timings(fn, *args, **kwargs):
+    """run_blocking inside a metrics trace; returns (result, timings)."""
+    return await run_blocking(metrics.traced, fn, *args, **kwargs)
+
+
+def with_timings(result, timings: dict, **fields) -> dict:
+    response = dict(result) if isinstance(result, dict) else {**fields, "recommendations": result}
+    response["timings"] = timings
+    return response
+
+
+def search_overrides(hnsw_ef: Optional[int], rescore: Optional[bool]):
+    """Per-request Qdrant search parameters, or None to use the defaults."""
+    if hnsw_ef is None and rescore is None:
+        return None
+    return search_params(hnsw_ef=hnsw_ef, rescore=rescore)
+
+
+@app.on_event("startup")
+async def start_warm_up():
+    if EMBEDDER_WARMUP:
+        inference_executor.submit(warm_up)
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "model_loaded": is_loaded()}
+
 
 @app.get("/recommend/product/{product_id}")
-def rec_product(product_id: int, limit: int = 10):
-    return recommend_for_product(product_id, k=limit)
+async def rec_product(product_id: int, limit: int = 10, debug: Optional[str] = None,
+                      hnsw_ef: Optional[int] = None, rescore: Optional[bool] = None):
+    params = search_overrides(hnsw_ef, rescore)
+    if debug == "timings":
+        # Always computed (not read from the cache) so the breakdown is real
+        result, timings = await run_with_timings(recommend_for_product, product_id, k=limit, params=params)
+        return with_timings(result, timings, product_id=product_id)
+    if params is not None:
+        # Tuning requests bypass the cache in both directions
+        return await run_blocking(recommend_for_product, product_id, k=limit, params=params)
+
+    key = cache.product_key(product_id, limit)
+    cached = cache.get_product(key)
+    if cached is not None:
+        return cached
+    result = await run_blocking(recommend_for_product, product_id, k=limit)
+    if result:
+        cache.set_product(key, result)
+    return result
 
 
 @app.get("/recommend/user/{user_id}")
-def rec_user(user_id: int, limit: int = 10):
-    return recommend_for_user(user_id, k=limit)
+async def rec_user(user_id: int, limit: int = 10, debug: Optional[str] = None,
+                   hnsw_ef: Optional[int] = None, rescore: Optional[bool] = None):
+    params = search_overrides(hnsw_ef, rescore)
+    if debug == "timings":
+        result, timings = await run_with_timings(recommend_for_user, user_id, k=limit, params=params)
+        return with_timings(result, timings, user_id=user_id)
+    if params is not None:
+        return await run_blocking(recommend_for_user, user_id, k=limit, params=params)
 
+    key = cache.user_key(user_id, limit)
+    cached = cache.get_user(key)
+    if cached is not None:
+        return cached
+    result = await run_blocking(recommend_for_user, user_id, k=limit)
+    if "error" not in result:
+        cache.set_user(key, result)
+    return result
 
-@app.post("/sync")
-def sync():
-    sync_products()
+
+class BatchUsersRequest(BaseModel):
+    user_ids: List[int]
+    limit: int = 10
+
+
+class BatchProductsRequest(BaseModel):
+    product_ids: List[int]
+    limit: int = 10
+
+
+@app.post("/recommend/products")
+async def rec_products(body: BatchProductsRequest):
+    keys = {pid: cache.product_key(pid, body.limit) for pid in body.product_ids}
+    results = {pid: cache.get_product(key) for pid, key in keys.items()}
+    misses = [pid for pid, result in results.items() if result is None]
+    if misses:
+        computed = await run_blocking(recommend_for_products, misses, k=body.limit)
+        for pid, result in zip(misses, computed):
+            results[pid] = result
+            if result:
+                cache.set_product(keys[pid], result)
+    return {"results": [results[pid] for pid in body.product_ids]}
+
+
+@app.post("/recommend/users")
+async def rec_users(body: BatchUsersRequest):
+    keys = {uid: cache.user_key(uid, body.limit) for uid in body.user_ids}
+    results = {uid: cache.get_user(key) for uid, key in keys.items()}
+    misses = [uid for uid, result in results.items() if result is None]
+    if misses:
+        computed = await run_blocking(recommend_for_users, misses, k=body.limit)
+        for uid, result in zip(misses, computed):
+            results[uid] = result
+            if "error" not in result:
+                cache.set_user(keys[uid], result)
+    return {"results": [results[uid] for uid in body.user_ids]}
+
+
+class InteractionEvent(BaseModel):
+    user_id: int
+    product_id: int
+    type: str  # "view" | "purchase"
+
+
+@app.post("/events/interaction")
+async def ingest_interaction(event: InteractionEvent):
+    if event.type not in ("view", "purchase"):
+        return JSONResponse(status_code=422, content={"error": f"Unknown interaction type: {event.type}"})
+    try:
+        updated = await run_blocking(apply_interaction, event.user_id, event.product_id, event.type)
+    finally:
+        # Only after the profile changed: a request reading the old profile
+        # in the meantime is cached under the old version, never the new one
+        cache.invalidate_user(event.user_id)
+    return {"status": "ok", "profile_updated": updated}
+
+
+@app.post("/cache/invalidate/user/{user_id}")
+async def invalidate_user_cache(user_id: int):
+    cache.invalidate_user(user_id)
     return {"status": "ok"}
+
+
+@app.post("/sync")
+async def sync(full: bool = False):
+    with sync_lock:
+        if sync_status["state"] == "running":
+            return JSONResponse(status_code=409, content={"status": "already_running", "job": dict(sync_status)})
+        sync_status.update(
+            state="running",
+            full=full,
+            started_at=datetime.now().isoformat(),
+            finished_at=None,
+            error=None
+        )
+        job = dict(sync_status)
+    sync_executor.submit(run_sync_job, full)
+    return JSONResponse(status_code=202, content={"status": "started", "job": job})
+
+
+@app.get("/sync/status")
+async def sync_job_status():
+    with sync_lock:
+        return dict(sync_status)
+
+
+@app.get("/stats/cache")
+async def cache_stats():
+    return cache.stats()
+
+
+@app.get("/stats/db-pool")
+async def db_pool_stats():
+    return pool_stats()
+
+
+@app.get("/stats/embedding-cache")
+async def embedding_cache_stats():
+    if embedding_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **embedding_cache.stats()}
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,235 @@
+# storage.py
+"""
+On-disk building blocks shared by the stores of the AI service.
+
+- write_atomic / FileWatch: a small file that writers replace atomically and
+  readers (in any process) re-read when its mtime changes.
+- GenerationDir: write-once generations of files plus a CURRENT pointer
+  naming the published one (product vector store, co-visitation model).
+- SQLiteConnections: per-thread connections to a WAL-mode SQLite database.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory file locks
+    fcntl = None
+
+# "<name>-<generation><ext>" data files and "<generation>.lock" writer locks
+_GENERATION_FILE = re.compile(r"^(?:.+-)?(\d+)(\..+)$")
+
+
+def write_atomic(path: str, text: str):
+    """Replace a file's contents; readers see either the old or the new text."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Unique per writer, so concurrent writers never share a temp file
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+class FileWatch:
+    """Reloads state derived from a file whenever the file's mtime changes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def refresh(self, load: Callable[[], None]) -> bool:
+        """
+        Call load() if the file changed since the last successful load.
+
+        Concurrent callers wait for a single load. A missing file is never
+        loaded. Returns True if load() ran.
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._mtime:
+            return False
+        with self._lock:
+            if mtime == self._mtime:
+                return False
+            load()
+            # If the file was replaced again meanwhile, the next call reloads it
+            self._mtime = mtime
+            return True
+
+
+class GenerationDir:
+    """
+    Write-once generations of files in one directory, plus a CURRENT pointer
+    naming the published generation.
+
+    Files of a generation are named "<name>-<generation><ext>". A writer
+    start()s a generation, holding a lock on it while it writes, and then
+    publish()es or abort()s it. Publishing swaps the pointer atomically and
+    deletes the files of every generation that is neither current nor still
+    being written (readers that mapped them keep working on POSIX). Both
+    run under a directory lock, so two processes writing at once never
+    delete each other's files.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.pointer = FileWatch(os.path.join(path, "CURRENT"))
+        self._writing: Dict[str, object] = {}  # generation -> open lock file
+        self._thread_lock = threading.Lock()
+
+    def file(self, name: str, generation: str, ext: str) -> str:
+        return os.path.join(self.path, f"{name}-{generation}{ext}")
+
+    def current(self) -> Optional[str]:
+        try:
+            with open(self.pointer.path) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def refresh(self, load: Callable[[str], None], attempts: int = 3) -> bool:
+        """
+        Call load(generation) when a different generation has been published.
+
+        A generation can be replaced and cleaned up between reading the
+        pointer and opening its files; load() is then retried on the newer one.
+        """
+        def load_current():
+            generation = self.current()
+            if generation is None:
+                raise FileNotFoundError(self.pointer.path)
+            load(generation)
+
+        for attempt in range(attempts):
+            try:
+                return self.pointer.refresh(load_current)
+            except FileNotFoundError:
+                if attempt == attempts - 1:
+                    raise
+        return False
+
+    @contextmanager
+    def _dir_lock(self):
+        with self._thread_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.path, "LOCK"), "a") as fh:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _lock_file(self, generation: str) -> str:
+        return os.path.join(self.path, f"{generation}.lock")
+
+    def start(self) -> str:
+        """Begin a new generation; its files are safe from cleanup until publish() or abort()."""
+        os.makedirs(self.path, exist_ok=True)
+        with self._dir_lock():
+            generation = str(time.time_ns())
+            while generation in self._writing:
+                generation = str(int(generation) + 1)
+            fh = open(self._lock_file(generation), "w")
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+            self._writing[generation] = fh
+        return generation
+
+    def publish(self, generation: str):
+        """Make the generation current and delete files no reader will open again."""
+        with self._dir_lock():
+            write_atomic(self.pointer.path, generation)
+            self._release(generation)
+            self._cleanup()
+
+    def abort(self, generation: str):
+        """Give up a started generation and delete its files."""
+        with self._dir_lock():
+            self._release(generation)
+            self._cleanup()
+
+    def _release(self, generation: str):
+        fh = self._writing.pop(generation, None)
+        if fh is not None:
+            try:
+                os.remove(self._lock_file(generation))
+            except OSError:
+                pass
+            fh.close()
+
+    def _in_progress(self, generation: str, current: Optional[str]) -> bool:
+        if generation in self._writing:
+            return True
+        if fcntl is None:
+            # Can't ask other processes; only generations older than the current one are surely done
+            return current is None or int(generation) > int(current)
+        try:
+            fh = open(self._lock_file(generation), "r")
+        except FileNotFoundError:
+            return False
+        with fh:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(fh, fcntl.LOCK_UN)
+            return False
+
+    def _cleanup(self):
+        # Deleting is best-effort: it fails on Windows while a mapping is open
+        current = self.current()
+        in_progress = {}
+        for name in os.listdir(self.path):
+            match = _GENERATION_FILE.match(name)
+            if match is None or match.group(1) == current:
+                continue
+            generation = match.group(1)
+            if generation not in in_progress:
+                in_progress[generation] = self._in_progress(generation, current)
+            if not in_progress[generation]:
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
+
+
+class SQLiteConnections:
+    """One connection per thread (sqlite3 connections can't be shared across threads), in WAL mode."""
+
+    def __init__(self, path: str, synchronous: Optional[str] = None):
+        self.path = path
+        self.synchronous = synchronous
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            if self.synchronous:
+                conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT, so concurrent writers serialize."""
+        conn = self.get()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
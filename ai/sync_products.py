@@ -1,80 +1,484 @@
 # sync_products.py
+import hashlib
 import json
-import mysql.connector
-from qdrant_client import QdrantClient
-from qdrant_client.http import models as qmodels
-from embedder import embed_text
-
-DB = {
-    "host": "127.0.0.1",
-    "user": "root",
-    "password": "",
-    "database": "ai_recommand"
-}
-
-QDRANT_URL = "http://localhost:6333"
-COLLECTION_NAME = "products"
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Optional
+from embedder import embed_batch
+from db_pool import DB, get_connection
+from vector_store import store as vector_store
+from search_backend import COLLECTION_NAME, QDRANT_URL, SEARCH_BACKEND
+import metrics
+from rec_cache import cache as rec_cache
+from tag_dictionary import tag_dictionary, parse_tags
+
+if TYPE_CHECKING:
+    # qdrant_client takes most of a second to import; only Qdrant syncs load it
+    from qdrant_client import QdrantClient
+
 VECTOR_SIZE = 384
 
+SYNC_CHUNK_SIZE = 500        # products per DB fetch / embedding / upsert chunk
+PIPELINE_QUEUE_CHUNKS = 2    # DB chunks buffered ahead of the embedding stage
+UPSERT_WORKERS = 4           # parallel Qdrant upserts
+UPSERT_RETRIES = 3
 
-def sync_products():
-    db = mysql.connector.connect(**DB)
-    cursor = db.cursor(dictionary=True)
+# Bump when the payload schema changes: the hash changes with it, so the next
+# incremental sync rewrites every point in the new schema
+PAYLOAD_VERSION = 2
 
-    print("Fetching products...")
-    cursor.execute("""
-        SELECT p.*, c.name AS category_name
-        FROM products p
-        LEFT JOIN categories c ON p.category_id = c.id
-    """)
-    products = cursor.fetchall()
+# Index layout of the collections built by a full sync (changes take effect
+# on the next POST /sync?full=true). With int8 quantization the quantized
+# vectors stay in RAM (4x smaller than float32) and the originals live on
+# disk, read only to rescore the top candidates.
+HNSW_M = int(os.getenv("QDRANT_HNSW_M", "16"))                         # graph links per node
+HNSW_EF_CONSTRUCT = int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", "100"))  # build-time candidate list size
+QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "int8")                # "int8" or "none"
+QUANTIZATION_QUANTILE = float(os.getenv("QDRANT_QUANTIZATION_QUANTILE", "0.99"))
+ON_DISK_PAYLOAD = os.getenv("QDRANT_ON_DISK_PAYLOAD", "1") == "1"
 
-    print(f"Found {len(products)} products")
+_END = object()
 
-    client = QdrantClient(url=QDRANT_URL)
 
-    client.recreate_collection(
-        collection_name=COLLECTION_NAME,
-        vectors_config=qmodels.VectorParams(
-            size=VECTOR_SIZE,
-            distance=qmodels.Distance.COSINE
-        )
+def build_product_text(p: dict) -> str:
+    """Combined text that gets embedded for a product row."""
+    tags = parse_tags(p.get("tags"))
+    return f"{p['name']} {p['description']} {p.get('category_name', '')} {' '.join(tags)}"
+
+
+def content_hash(p: dict) -> str:
+    """Stable hash of a product row, used to detect changed products."""
+    raw = json.dumps({"payload_version": PAYLOAD_VERSION, "row": p}, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def build_payload(p: dict) -> dict:
+    """
+    Compact Qdrant payload: display fields, integer category id and tag ids.
+
+    The rest of the MySQL row (description, timestamps, raw tags) only feeds
+    the embedding and the content hash, so it is not stored per point.
+    """
+    return {
+        "id": int(p["id"]),
+        "name": p.get("name"),
+        "price": p.get("price"),
+        "image_url": p.get("image_url"),
+        "category_id": int(p["category_id"]) if p.get("category_id") is not None else None,
+        "category_name": p.get("category_name"),
+        "tag_ids": tag_dictionary.ids(parse_tags(p.get("tags")), add=True),
+        "content_hash": content_hash(p),
+    }
+
+
+def stream_products(chunk_size: int = SYNC_CHUNK_SIZE):
+    """
+    Yield product rows in chunks from an unbuffered (server-side) cursor,
+    so the whole table is never held in memory.
+    """
+    with get_connection() as db:
+        cursor = db.cursor(dictionary=True, buffered=False)
+        exhausted = False
+        try:
+            cursor.execute("""
+                SELECT p.*, c.name AS category_name
+                FROM products p
+                LEFT JOIN categories c ON p.category_id = c.id
+            """)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    exhausted = True
+                    return
+                yield rows
+        finally:
+            if not exhausted:
+                # Stopped early: drain the result set so the pooled connection stays usable
+                db.consume_results()
+            cursor.close()
+
+
+def embed_products(products: list):
+    """Embed products and build their payloads (each carries the content hash)."""
+    with metrics.span("sync.embed"):
+        vectors = embed_batch([build_product_text(p) for p in products])
+    return vectors, [build_payload(p) for p in products]
+
+
+def build_points(ids: list, vectors, payloads: list) -> list:
+    from qdrant_client.http import models as qmodels
+
+    return [
+        qmodels.PointStruct(id=pid, vector=vec.tolist(), payload=payload)
+        for pid, vec, payload in zip(ids, vectors, payloads)
+    ]
+
+
+def upsert_with_retry(client: "QdrantClient", collection_name: str, points: list,
+                      retries: int = UPSERT_RETRIES):
+    for attempt in range(1, retries + 1):
+        try:
+            metrics.count("qdrant_calls")
+            with metrics.span("sync.upsert"):
+                client.upsert(collection_name=collection_name, points=points)
+            return
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = 0.5 * 2 ** (attempt - 1)
+            print(f"⚠️ Upsert of {len(points)} points failed ({e}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+
+def _read_ahead(chunks, out: queue.Queue, stop: threading.Event):
+    """Producer thread: push DB chunks onto a bounded queue."""
+    try:
+        for chunk in chunks:
+            while not stop.is_set():
+                try:
+                    out.put(chunk, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+            if stop.is_set():
+                break
+        out.put(_END)
+    except BaseException as e:
+        out.put(e)
+    finally:
+        chunks.close()
+
+
+def run_sync_pipeline(client: Optional["QdrantClient"], collection_name: Optional[str], writer,
+                      indexed_hashes: Optional[dict] = None) -> dict:
+    """
+    Stream products through embed -> upsert with the stages overlapping.
+
+    A reader thread fetches DB chunks into a bounded queue, this thread embeds
+    them, and a small pool uploads the points. At most a few chunks are in
+    flight at once, so memory stays flat regardless of catalog size.
+
+    Args:
+        client: Qdrant client (None to fill only the vector store)
+        collection_name: Collection to upsert into
+        writer: VectorStoreWriter receiving the new vectors and payloads
+        indexed_hashes: {product_id: content_hash} already in the collection;
+            when given, unchanged products are skipped
+
+    Returns:
+        {"seen_ids": set, "changed_ids": set}
+    """
+    chunks = queue.Queue(maxsize=PIPELINE_QUEUE_CHUNKS)
+    stop = threading.Event()
+    reader = threading.Thread(
+        target=_read_ahead, args=(stream_products(), chunks, stop), daemon=True
     )
+    reader.start()
+
+    seen_ids = set()
+    changed_ids = set()
+    uploads = deque()
+
+    try:
+        with ThreadPoolExecutor(max_workers=UPSERT_WORKERS) as executor:
+            while True:
+                item = chunks.get()
+                if item is _END:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+
+                seen_ids.update(int(p["id"]) for p in item)
+                if indexed_hashes is not None:
+                    item = [p for p in item if indexed_hashes.get(int(p["id"])) != content_hash(p)]
+                if not item:
+                    continue
+
+                ids = [int(p["id"]) for p in item]
+                vectors, payloads = embed_products(item)
+                # Tag ids assigned for this chunk must be on disk before any point uses them
+                tag_dictionary.save()
+                writer.append(ids, vectors, payloads)
+                changed_ids.update(int(p["id"]) for p in item)
+                metrics.count("synced_products", len(item))
+
+                if client is not None:
+                    points = build_points(ids, vectors, payloads)
+                    uploads.append(executor.submit(upsert_with_retry, client, collection_name, points))
+                # Bound in-flight uploads so embedded chunks don't pile up in memory
+                while len(uploads) >= UPSERT_WORKERS * 2:
+                    uploads.popleft().result()
+
+                print(f"   ...{len(seen_ids)} products read, {len(changed_ids)} embedded")
+
+            while uploads:
+                uploads.popleft().result()
+    finally:
+        stop.set()
+        # Unblock the reader if it is waiting on a full queue
+        while reader.is_alive():
+            try:
+                chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    return {"seen_ids": seen_ids, "changed_ids": changed_ids}
+
+
+def resolve_alias(client: "QdrantClient", alias: str = COLLECTION_NAME):
+    """Return the collection the serving alias points to, or None."""
+    for a in client.get_aliases().aliases:
+        if a.alias_name == alias:
+            return a.collection_name
+    return None
+
 
-    points = []
+def fetch_indexed_hashes(client: "QdrantClient", collection_name: str) -> dict:
+    """Scroll the collection and return {product_id: content_hash} without vectors."""
+    hashes = {}
+    offset = None
+    while True:
+        records, offset = client.scroll(
+            collection_name=collection_name,
+            limit=1000,
+            offset=offset,
+            with_payload=["content_hash"],
+            with_vectors=False
+        )
+        for r in records:
+            hashes[int(r.id)] = (r.payload or {}).get("content_hash")
+        if offset is None:
+            return hashes
+
+
+def ensure_payload_indexes(client: "QdrantClient", collection_name: str):
+    """Index payload fields used in search filters (no-op if they already exist)."""
+    from qdrant_client.http import models as qmodels
+
+    client.create_payload_index(
+        collection_name=collection_name,
+        field_name="category_id",
+        field_schema=qmodels.PayloadSchemaType.INTEGER
+    )
 
-    for p in products:
-        tags = json.loads(p["tags"]) if p["tags"] else []
-        combined = f"{p['name']} {p['description']} {p['category_name']} {' '.join(tags)}"
 
-        vec = embed_text(combined)
+def collection_config() -> dict:
+    """create_collection arguments for the configured HNSW / quantization layout."""
+    from qdrant_client.http import models as qmodels
 
-        points.append(
-            qmodels.PointStruct(
-                id=int(p["id"]),
-                vector=vec,
-                payload=p
+    if QUANTIZATION not in ("int8", "none"):
+        raise ValueError(f"Unknown QDRANT_QUANTIZATION: {QUANTIZATION}")
+    quantized = QUANTIZATION == "int8"
+    return {
+        "vectors_config": qmodels.VectorParams(
+            size=VECTOR_SIZE,
+            distance=qmodels.Distance.COSINE,
+            # Originals on disk only when the quantized copy serves searches
+            on_disk=quantized
+        ),
+        "hnsw_config": qmodels.HnswConfigDiff(m=HNSW_M, ef_construct=HNSW_EF_CONSTRUCT),
+        "quantization_config": qmodels.ScalarQuantization(
+            scalar=qmodels.ScalarQuantizationConfig(
+                type=qmodels.ScalarType.INT8,
+                quantile=QUANTIZATION_QUANTILE,
+                always_ram=True
             )
+        ) if quantized else None,
+        "on_disk_payload": ON_DISK_PAYLOAD,
+    }
+
+
+def rebuild_collection(client: "QdrantClient"):
+    """
+    Build a fresh versioned collection and atomically repoint the alias.
+
+    Serving keeps reading the old collection until the alias switch, so it
+    never sees an empty or partial index.
+    """
+    from qdrant_client.http import models as qmodels
+
+    new_collection = f"{COLLECTION_NAME}_{int(time.time() * 1000)}"
+    client.create_collection(collection_name=new_collection, **collection_config())
+    ensure_payload_indexes(client, new_collection)
+
+    print(f"Embedding and uploading into '{new_collection}'...")
+    writer = vector_store.writer()
+    try:
+        with metrics.span("sync.pipeline"):
+            result = run_sync_pipeline(client, new_collection, writer)
+    except BaseException:
+        writer.abort()
+        client.delete_collection(new_collection)
+        raise
+    print(f"Indexed {len(result['changed_ids'])} products")
+
+    old_collection = resolve_alias(client)
+    operations = [
+        qmodels.CreateAliasOperation(
+            create_alias=qmodels.CreateAlias(collection_name=new_collection, alias_name=COLLECTION_NAME)
         )
+    ]
+    if old_collection:
+        operations.insert(0, qmodels.DeleteAliasOperation(
+            delete_alias=qmodels.DeleteAlias(alias_name=COLLECTION_NAME)
+        ))
+    migrating = False
+    if not old_collection and client.collection_exists(COLLECTION_NAME):
+        # One-time migration from the pre-alias layout: a real collection
+        # holds the serving name, so it has to go before the alias can exist.
+        client.delete_collection(COLLECTION_NAME)
+        migrating = True
+
+    try:
+        with metrics.span("sync.alias_swap"):
+            client.update_collection_aliases(change_aliases_operations=operations)
+    except BaseException:
+        writer.abort()
+        if migrating:
+            # The old collection is already gone: keep the new one so the
+            # alias can still be pointed at it instead of serving nothing
+            print(f"⚠️ Alias swap failed; '{new_collection}' is kept, point '{COLLECTION_NAME}' at it "
+                  f"or run the full sync again")
+        else:
+            client.delete_collection(new_collection)
+        raise
+    print(f"Alias '{COLLECTION_NAME}' -> '{new_collection}'")
+
+    # Keep the local vector store in step so user profiles need no embedding
+    with metrics.span("sync.vector_store_commit"):
+        writer.commit()
+
+    rec_cache.bump_sync_generation()
+
+    if old_collection and old_collection != new_collection:
+        client.delete_collection(old_collection)
+    elif not old_collection:
+        # Collections kept by an earlier failed migration were never served
+        for collection in client.get_collections().collections:
+            if collection.name.startswith(f"{COLLECTION_NAME}_") and collection.name != new_collection:
+                client.delete_collection(collection.name)
 
-    print("Uploading to Qdrant...")
-    client.upsert(collection_name=COLLECTION_NAME, points=points)
 
-    print("✅ Sync completed successfully.")
+def commit_incremental(writer, changed: set, removed: list):
+    """Publish an incremental vector store generation, or drop it if nothing changed."""
+    if changed or removed:
+        with metrics.span("sync.vector_store_commit"):
+            writer.commit(keep_existing_except=changed | set(removed))
+        rec_cache.bump_sync_generation()
+    else:
+        writer.abort()
+
+
+def sync_vector_store(full: bool = False):
+    """
+    Sync MySQL products into the local vector store only (SEARCH_BACKEND=local).
+
+    Same pipeline and content-hash diffing as the Qdrant sync, with the
+    hashes read from the stored payloads instead of the collection.
+    """
+    indexed = None if full else vector_store.content_hashes()
+
+    writer = vector_store.writer()
+    try:
+        with metrics.span("sync.pipeline"):
+            result = run_sync_pipeline(None, None, writer, indexed_hashes=indexed)
+    except BaseException:
+        writer.abort()
+        raise
+
+    if indexed is None:
+        with metrics.span("sync.vector_store_commit"):
+            writer.commit()
+        rec_cache.bump_sync_generation()
+        print(f"✅ Full sync completed successfully ({len(result['changed_ids'])} products).")
+        return
+
+    changed = result["changed_ids"]
+    removed = [pid for pid in indexed if pid not in result["seen_ids"]]
+    print(f"{len(changed)} changed, {len(removed)} removed")
+    commit_incremental(writer, changed, removed)
+    print("✅ Incremental sync completed successfully.")
+
+
+def sync_products(full: bool = False, client: Optional["QdrantClient"] = None):
+    """
+    Sync MySQL products into Qdrant.
+
+    Incremental by default: only products whose content hash changed are
+    re-embedded and upserted, and products removed from MySQL are deleted.
+    A full rebuild (or a first sync) builds a new collection behind the alias.
+    Products are streamed in chunks either way, so memory use is bounded.
+    With SEARCH_BACKEND=local and no client given, only the local vector
+    store is synced.
+
+    Args:
+        full: Force a full rebuild instead of an incremental sync
+        client: Qdrant client to use (defaults to QDRANT_URL)
+    """
+    if client is None:
+        if SEARCH_BACKEND == "local":
+            sync_vector_store(full)
+            return
+        from qdrant_client import QdrantClient
+
+        client = QdrantClient(url=QDRANT_URL)
+
+    collection = resolve_alias(client)
+    if full or collection is None:
+        rebuild_collection(client)
+        print("✅ Full sync completed successfully.")
+        return
+
+    ensure_payload_indexes(client, collection)
+    with metrics.span("sync.fetch_indexed_hashes"):
+        indexed = fetch_indexed_hashes(client, collection)
+    print(f"{len(indexed)} products indexed, checking for changes...")
+
+    writer = vector_store.writer()
+    try:
+        with metrics.span("sync.pipeline"):
+            result = run_sync_pipeline(client, collection, writer, indexed_hashes=indexed)
+    except BaseException:
+        writer.abort()
+        raise
+
+    changed = result["changed_ids"]
+    removed = [pid for pid in indexed if pid not in result["seen_ids"]]
+    print(f"{len(changed)} changed, {len(removed)} removed")
+
+    if removed:
+        from qdrant_client.http import models as qmodels
+
+        with metrics.span("sync.delete_removed"):
+            client.delete(
+                collection_name=collection,
+                points_selector=qmodels.PointIdsList(points=removed)
+            )
+
+    # Keep the local vector store in step so user profiles need no embedding
+    commit_incremental(writer, changed, removed)
+
+    print("✅ Incremental sync completed successfully.")
 
 
 def fetch_product(product_id: int):
-    db = mysql.connector.connect(**DB)
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("""
-        SELECT p.*, c.name AS category_name
-        FROM products p
-        LEFT JOIN categories c ON p.category_id = c.id
-        WHERE p.id = %s
-    """, (product_id,))
-    result = cursor.fetchone()
-    cursor.close()
-    db.close()
+    with get_connection() as db:
+        cursor = db.cursor(dictionary=True)
+        try:
+            cursor.execute("""
+                SELECT p.*, c.name AS category_name
+                FROM products p
+                LEFT JOIN categories c ON p.category_id = c.id
+                WHERE p.id = %s
+            """, (product_id,))
+            result = cursor.fetchone()
+        finally:
+            cursor.close()
     return result
 
 
@@ -91,9 +495,6 @@ def fetch_products_batch(product_ids: list):
     if not product_ids:
         return {}
     
-    db = mysql.connector.connect(**DB)
-    cursor = db.cursor(dictionary=True)
-    
     # Build IN clause with placeholders
     placeholders = ','.join(['%s'] * len(product_ids))
     query = f"""
@@ -103,14 +504,18 @@ def fetch_products_batch(product_ids: list):
         WHERE p.id IN ({placeholders})
     """
     
-    cursor.execute(query, tuple(product_ids))
-    results = cursor.fetchall()
-    cursor.close()
-    db.close()
+    with get_connection() as db:
+        cursor = db.cursor(dictionary=True)
+        try:
+            cursor.execute(query, tuple(product_ids))
+            results = cursor.fetchall()
+        finally:
+            cursor.close()
     
     # Return as dictionary for easy lookup
     return {product['id']: product for product in results}
 
 
 if __name__ == "__main__":
-    sync_products()
+    # python sync_products.py [--full]
+    sync_products(full="--full" in sys.argv[1:])
@@ -0,0 +1,87 @@
+# tag_dictionary.py
+"""
+Tag string -> integer id mapping, built by sync_products.
+
+Qdrant payloads store tags as small integer arrays instead of the JSON
+string from MySQL. Ids are append-only, so points written by earlier syncs
+stay valid; the mapping is saved as JSON and re-read by other processes
+when the file changes.
+"""
+import json
+import os
+import threading
+from typing import Dict, Iterable, List
+
+from storage import FileWatch, write_atomic
+
+TAG_DICTIONARY_FILE = os.getenv(
+    "TAG_DICTIONARY_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "tag_dictionary.json")
+)
+
+
+def parse_tags(value) -> list:
+    """Tags from a MySQL row value (JSON string or list)."""
+    try:
+        tags = json.loads(value) if isinstance(value, str) else value
+        return tags or []
+    except (TypeError, ValueError):
+        return []
+
+
+class TagDictionary:
+
+    def __init__(self, path: str = TAG_DICTIONARY_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._watch = FileWatch(path)
+        self._ids: Dict[str, int] = {}
+        self._dirty = False
+
+    def _load(self):
+        with open(self.path) as f:
+            self._ids = json.load(f)
+
+    def _refresh(self):
+        # Unsaved new ids take precedence over the file until save()
+        if not self._dirty:
+            self._watch.refresh(self._load)
+
+    def ids(self, tags: Iterable, add: bool = False) -> List[int]:
+        """
+        Ids for the given tags, de-duplicated, in first-seen order.
+
+        Args:
+            tags: Tag strings
+            add: Assign ids to unknown tags (sync only); otherwise they are dropped
+        """
+        with self._lock:
+            self._refresh()
+            out = []
+            for tag in map(str, tags):
+                tag_id = self._ids.get(tag)
+                if tag_id is None:
+                    if not add:
+                        continue
+                    tag_id = len(self._ids)
+                    self._ids[tag] = tag_id
+                    self._dirty = True
+                if tag_id not in out:
+                    out.append(tag_id)
+            return out
+
+    def save(self):
+        """Write new ids to disk (call before publishing points that use them)."""
+        with self._lock:
+            if not self._dirty:
+                return
+            write_atomic(self.path, json.dumps(self._ids))
+            self._dirty = False
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._ids)
+
+
+tag_dictionary = TagDictionary()
@@ -2,9 +2,17 @@ import json
 import pandas as pd
 import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy import sparse
 import mysql.connector
 from datetime import datetime
+import covisitation
+from rec_cache import cache as rec_cache
+
+TOP_K_NEIGHBOURS = 50                 # similar products kept per product
+SIM_BLOCK_BYTES = 256 * 1024 * 1024   # memory budget for one block of dense similarity rows
+RECS_PER_USER = 5
+USER_BLOCK_SIZE = 50000               # users scored per sparse matrix product
+INSERT_BATCH_SIZE = 5000              # rows per executemany batch
 
 # ========================
 # 1️⃣ Connect to Database
@@ -29,11 +37,13 @@ cursor.execute("""
 """)
 products = pd.DataFrame(cursor.fetchall())
 
-cursor.execute("SELECT user_id, product_id FROM visited_products")
-visited = pd.DataFrame(cursor.fetchall())
+INTERACTION_COLUMNS = ["user_id", "product_id", "occurred_at"]
+
+cursor.execute("SELECT user_id, product_id, visited_at AS occurred_at FROM visited_products")
+visited = pd.DataFrame(cursor.fetchall(), columns=INTERACTION_COLUMNS)
 
-cursor.execute("SELECT user_id, product_id FROM purchased_products")
-purchased = pd.DataFrame(cursor.fetchall())
+cursor.execute("SELECT user_id, product_id, purchased_at AS occurred_at FROM purchased_products")
+purchased = pd.DataFrame(cursor.fetchall(), columns=INTERACTION_COLUMNS)
 
 if products.empty:
     print("⚠️ No products found. Exiting.")
@@ -60,47 +70,122 @@ products['combined_text'] = products.apply(combine_features, axis=1)
 # ========================
 # 4️⃣ TF-IDF Vectorization (Content Similarity)
 # ========================
+def top_k_similarity(matrix, k=TOP_K_NEIGHBOURS, block_bytes=SIM_BLOCK_BYTES):
+    """
+    Sparse top-k cosine neighbour graph of the rows of an L2-normalised
+    sparse matrix. Rows are processed in blocks so only a block of the
+    N x N similarity matrix is ever dense, giving O(N*k) memory overall.
+    """
+    n = matrix.shape[0]
+    k = min(k, n)
+    block_rows = max(1, block_bytes // (n * 8))
+    matrix_t = matrix.T.tocsr()
+
+    rows, cols, vals = [], [], []
+    for start in range(0, n, block_rows):
+        stop = min(start + block_rows, n)
+        block = (matrix[start:stop] @ matrix_t).toarray()
+
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        top_vals = np.take_along_axis(block, top, axis=1)
+        keep = top_vals > 0
+
+        rows.append(np.broadcast_to(np.arange(start, stop)[:, None], top.shape)[keep])
+        cols.append(top[keep])
+        vals.append(top_vals[keep].astype(np.float32))
+
+    return sparse.csr_matrix(
+        (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(n, n)
+    )
+
 tfidf = TfidfVectorizer(stop_words='english')
-tfidf_matrix = tfidf.fit_transform(products['combined_text'].fillna(''))
-content_sim = cosine_similarity(tfidf_matrix, tfidf_matrix)
+tfidf_matrix = tfidf.fit_transform(products['combined_text'].fillna(''))  # rows are L2-normalised
+content_sim = top_k_similarity(tfidf_matrix)
 
 # ========================
 # 5️⃣ Collaborative Filtering (Co-visitation)
 # ========================
-interactions = pd.concat([visited, purchased]).drop_duplicates()
-user_groups = interactions.groupby('user_id')['product_id'].apply(list).to_dict()
+# Item-to-item co-occurrence of views and purchases (time-decayed, top-k
+# per product), saved for online reranking and blended with content
+# similarity for the stored recommendations below.
+product_ids = products['id'].to_numpy()
+id_to_index = pd.Series(np.arange(len(product_ids)), index=product_ids)
+
+events = pd.concat([visited.assign(purchase=False), purchased.assign(purchase=True)], ignore_index=True)
+events = events[events['product_id'].isin(id_to_index.index)]
+
+item_sim = content_sim
+if not events.empty:
+    timestamps = pd.to_datetime(events['occurred_at']).to_numpy(dtype='datetime64[s]').astype(np.int64)
+    event_users = np.unique(events['user_id'].to_numpy(), return_inverse=True)[1]
+    recent = covisitation.most_recent_per_user(event_users, timestamps)
+    covis_sim = covisitation.build_matrix(
+        event_users[recent],
+        id_to_index.loc[events['product_id']].to_numpy()[recent],
+        covisitation.interaction_weights(timestamps[recent], events['purchase'].to_numpy()[recent]),
+        len(product_ids)
+    )
+    covisitation.model.save(covis_sim, product_ids)
+    rec_cache.bump_sync_generation()  # cached product results predate the new model
+    print(f"Co-visitation model: {covis_sim.nnz} neighbour pairs")
+    item_sim = content_sim + covisitation.COVISITATION_WEIGHT * covis_sim
+
+interactions = pd.concat([visited, purchased])[['user_id', 'product_id']].drop_duplicates()
 
 recommendations = {}
 
-id_to_index = {pid: idx for idx, pid in enumerate(products['id'])}
+if not interactions.empty:
+    # User x item interaction matrix (one entry per distinct user/product pair)
+    interactions = interactions[interactions['product_id'].isin(id_to_index.index)]
 
-for user, items in user_groups.items():
-    valid_indices = [id_to_index[i] for i in items if i in id_to_index]
-    if not valid_indices:
-        continue  # skip if user has no matching products
+    user_ids, user_index = np.unique(interactions['user_id'].to_numpy(), return_inverse=True)
+    item_index = id_to_index.loc[interactions['product_id']].to_numpy()
+    seen = sparse.csr_matrix(
+        (np.ones(len(item_index), dtype=np.float32), (user_index, item_index)),
+        shape=(len(user_ids), len(product_ids))
+    )
 
-    # Average similarity scores for all user's interacted items
-    scores = content_sim[valid_indices].mean(axis=0)
-    top_indices = np.argsort(scores)[::-1]
+    # Average similarity of each user's interacted items = row-normalised
+    # interactions times the top-k content + co-visitation graph, in user blocks
+    counts = np.asarray(seen.sum(axis=1)).ravel()
+    user_profiles = sparse.diags(1.0 / counts) @ seen
 
-    top_recs = [
-        int(products.iloc[i]['id'])
-        for i in top_indices
-        if int(products.iloc[i]['id']) not in items
-    ][:5]
+    for start in range(0, len(user_ids), USER_BLOCK_SIZE):
+        stop = min(start + USER_BLOCK_SIZE, len(user_ids))
+        scores = (user_profiles[start:stop] @ item_sim).tocsr()
 
-    recommendations[user] = top_recs
+        # Mask items the user already interacted with
+        scores = scores - scores.multiply(seen[start:stop])
+        scores.eliminate_zeros()
+
+        rows, cols, _ = covisitation.top_k_per_row(scores, RECS_PER_USER)
+        rec_ids = product_ids[cols]
+        splits = np.searchsorted(rows, np.arange(1, stop - start))
+        for offset, recs in enumerate(np.split(rec_ids, splits)):
+            recommendations[int(user_ids[start + offset])] = [int(pid) for pid in recs]
 
 # ========================
 # 6️⃣ Save Results to DB
 # ========================
-cursor.execute("DELETE FROM recommendations")
-
-for user_id, recs in recommendations.items():
-    cursor.execute("""
-        INSERT INTO recommendations (user_id, recommended_products, created_at, updated_at)
-        VALUES (%s, %s, %s, %s)
-    """, (user_id, json.dumps(recs), datetime.now(), datetime.now()))
+# Replace all rows inside one transaction: readers keep seeing the previous
+# recommendations until the commit, so the table is never empty mid-run.
+now = datetime.now()
+rows = [
+    (user_id, json.dumps(recs), now, now)
+    for user_id, recs in recommendations.items()
+]
+
+try:
+    cursor.execute("DELETE FROM recommendations")
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        cursor.executemany("""
+            INSERT INTO recommendations (user_id, recommended_products, created_at, updated_at)
+            VALUES (%s, %s, %s, %s)
+        """, rows[start:start + INSERT_BATCH_SIZE])
+    db.commit()
+except Exception:
+    db.rollback()
+    raise
 
-db.commit()
 print(f"✅ AI model retrained successfully for {len(recommendations)} users.")
@@ -3,67 +3,113 @@
 Helper module for building user profiles from activity data.
 Fetches user activity from MySQL and creates aggregated embeddings.
 """
-import json
-import mysql.connector
 import numpy as np
-from typing import List, Dict, Optional, Tuple
-from embedder import embed_text
-from sync_products import fetch_product, DB
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Dict, Optional, Set
+from embedder import embed_batch
+from sync_products import fetch_products_batch, build_product_text
+from db_pool import get_connection
+from vector_store import store as vector_store
 
+# Profile weights by activity type
+PURCHASE_WEIGHT = 2.0
+VIEW_WEIGHT = 1.0
+FALLBACK_WEIGHT = 0.5  # products from the most viewed category
 
-def fetch_user_activity(user_id: int) -> Dict[str, List[int]]:
+MAX_RECENT_PURCHASES = 5
+MAX_RECENT_VIEWS = 5
+
+
+@dataclass
+class UserActivity:
+    """
+    Snapshot of a user's activity, loaded once per request and shared
+    by all profile helpers.
+    
+    purchases / views are product ids ordered by most recent first
+    (one entry per row, so repeated views appear more than once).
+    """
+    user_id: int
+    purchases: List[int] = field(default_factory=list)
+    views: List[int] = field(default_factory=list)
+    purchase_dates: Dict[int, datetime] = field(default_factory=dict)
+    view_dates: Dict[int, datetime] = field(default_factory=dict)
+    view_categories: Dict[int, int] = field(default_factory=dict)  # category_id -> view count
+    
+    @property
+    def interacted(self) -> Set[int]:
+        return set(self.purchases) | set(self.views)
+    
+    def top_view_category(self) -> Optional[int]:
+        if not self.view_categories:
+            return None
+        return max(self.view_categories.items(), key=lambda x: x[1])[0]
+
+
+def fetch_user_activity(user_id: int) -> UserActivity:
     """
-    Fetch all user activity from MySQL.
+    Fetch all user activity from MySQL with a single UNION query.
     
     Returns:
-        {
-            'purchases': [product_id, ...],
-            'views': [product_id, ...],
-            'purchase_dates': {product_id: timestamp, ...},
-            'view_dates': {product_id: timestamp, ...}
-        }
-    """
-    db = mysql.connector.connect(**DB)
-    cursor = db.cursor(dictionary=True)
-    
-    activity = {
-        'purchases': [],
-        'views': [],
-        'purchase_dates': {},
-        'view_dates': {}
-    }
-    
-    try:
-        # Fetch purchases (ordered by most recent first)
-        cursor.execute("""
-            SELECT product_id, purchased_at
-            FROM purchased_products
-            WHERE user_id = %s
-            ORDER BY purchased_at DESC
-        """, (user_id,))
-        purchases = cursor.fetchall()
-        activity['purchases'] = [p['product_id'] for p in purchases]
-        activity['purchase_dates'] = {p['product_id']: p['purchased_at'] for p in purchases}
+        UserActivity snapshot
+    """
+    return fetch_user_activity_batch([user_id])[user_id]
+
+
+def fetch_user_activity_batch(user_ids: List[int]) -> Dict[int, UserActivity]:
+    """
+    Fetch activity for many users with a single UNION query.
+    
+    Args:
+        user_ids: List of user IDs
         
-        # Fetch views (ordered by most recent first)
-        cursor.execute("""
-            SELECT product_id, visited_at
-            FROM visited_products
-            WHERE user_id = %s
-            ORDER BY visited_at DESC
-        """, (user_id,))
-        views = cursor.fetchall()
-        activity['views'] = [v['product_id'] for v in views]
-        activity['view_dates'] = {v['product_id']: v['visited_at'] for v in views}
+    Returns:
+        Dictionary mapping user_id -> UserActivity (empty snapshot for users with no activity)
+    """
+    activities = {user_id: UserActivity(user_id=user_id) for user_id in user_ids}
+    if not activities:
+        return activities
+    
+    placeholders = ','.join(['%s'] * len(activities))
+    query = f"""
+        SELECT 'purchase' AS kind, pp.user_id, pp.product_id, pp.purchased_at AS occurred_at, p.category_id
+        FROM purchased_products pp
+        LEFT JOIN products p ON pp.product_id = p.id
+        WHERE pp.user_id IN ({placeholders})
+        UNION ALL
+        SELECT 'view' AS kind, vp.user_id, vp.product_id, vp.visited_at AS occurred_at, p.category_id
+        FROM visited_products vp
+        LEFT JOIN products p ON vp.product_id = p.id
+        WHERE vp.user_id IN ({placeholders})
+        ORDER BY occurred_at DESC
+    """
+    
+    with get_connection() as db:
+        cursor = db.cursor(dictionary=True)
+        try:
+            # Purchases and views in one round trip (ordered by most recent first)
+            cursor.execute(query, tuple(activities) * 2)
+            
+            for row in cursor.fetchall():
+                activity = activities[row['user_id']]
+                if row['kind'] == 'purchase':
+                    activity.purchases.append(row['product_id'])
+                    activity.purchase_dates[row['product_id']] = row['occurred_at']
+                else:
+                    activity.views.append(row['product_id'])
+                    activity.view_dates[row['product_id']] = row['occurred_at']
+                    if row['category_id'] is not None:
+                        activity.view_categories[row['category_id']] = activity.view_categories.get(row['category_id'], 0) + 1
         
-    finally:
-        cursor.close()
-        db.close()
+        finally:
+            cursor.close()
     
-    return activity
+    return activities
 
 
-def get_top_representative_products(user_id: int, max_products: int = 10) -> List[int]:
+def get_top_representative_products(user_id: int, max_products: int = 10,
+                                    activity: Optional[UserActivity] = None) -> List[int]:
     """
     Select top representative products for user profile.
     Priority: recent purchases > recent views > most viewed category.
@@ -71,17 +117,19 @@ def get_top_representative_products(user_id: int, max_products: int = 10) -> Lis
     Args:
         user_id: User ID
         max_products: Maximum number of products to include
+        activity: Preloaded activity snapshot (fetched if omitted)
         
     Returns:
         List of product IDs
     """
-    activity = fetch_user_activity(user_id)
+    if activity is None:
+        activity = fetch_user_activity(user_id)
     
     selected_products = []
     seen = set()
     
     # 1. Prioritize recent purchases (up to 5)
-    for product_id in activity['purchases'][:5]:
+    for product_id in activity.purchases[:MAX_RECENT_PURCHASES]:
         if product_id not in seen:
             selected_products.append(product_id)
             seen.add(product_id)
@@ -89,7 +137,7 @@ def get_top_representative_products(user_id: int, max_products: int = 10) -> Lis
                 return selected_products
     
     # 2. Add recent views (up to 5)
-    for product_id in activity['views'][:5]:
+    for product_id in activity.views[:MAX_RECENT_VIEWS]:
         if product_id not in seen:
             selected_products.append(product_id)
             seen.add(product_id)
@@ -97,112 +145,96 @@ def get_top_representative_products(user_id: int, max_products: int = 10) -> Lis
                 return selected_products
     
     # 3. Fallback: most viewed category
-    if len(selected_products) < max_products:
-        db = mysql.connector.connect(**DB)
-        cursor = db.cursor(dictionary=True)
-        
-        try:
-            # Find most viewed category
-            cursor.execute("""
-                SELECT p.category_id, COUNT(*) as view_count
-                FROM visited_products vp
-                JOIN products p ON vp.product_id = p.id
-                WHERE vp.user_id = %s
-                GROUP BY p.category_id
-                ORDER BY view_count DESC
-                LIMIT 1
-            """, (user_id,))
-            result = cursor.fetchone()
-            
-            if result:
-                category_id = result['category_id']
-                # Get products from that category (excluding already selected)
-                placeholders = ','.join(['%s'] * len(selected_products)) if selected_products else '0'
-                query = f"""
-                    SELECT id FROM products
-                    WHERE category_id = %s
-                    AND id NOT IN ({placeholders})
-                    LIMIT %s
-                """
-                params = [category_id] + selected_products + [max_products - len(selected_products)]
-                cursor.execute(query, params)
-                category_products = [row['id'] for row in cursor.fetchall()]
-                selected_products.extend(category_products)
-        finally:
-            cursor.close()
-            db.close()
+    category_id = activity.top_view_category()
+    if len(selected_products) < max_products and category_id is not None:
+        # Get products from that category (excluding already selected)
+        selected_products.extend(get_category_products(
+            category_id, max_products - len(selected_products), exclude=selected_products
+        ))
     
     return selected_products[:max_products]
 
 
-def build_user_profile_vector(user_id: int, max_products: int = 10) -> Optional[np.ndarray]:
+def get_category_products(category_id: int, limit: int, exclude: List[int] = ()) -> List[int]:
     """
-    Build aggregated user profile vector from their activity.
+    First products of a category by id, skipping the excluded ones.
     
-    Args:
-        user_id: User ID
-        max_products: Maximum number of products to consider
-        
     Returns:
-        Aggregated embedding vector (numpy array) or None if no activity
+        List of product IDs
     """
-    product_ids = get_top_representative_products(user_id, max_products)
-    
-    if not product_ids:
-        return None
-    
-    embeddings = []
-    weights = []
-    activity = fetch_user_activity(user_id)
-    
-    for product_id in product_ids:
-        product = fetch_product(product_id)
-        if not product:
-            continue
-        
-        # Build combined text (same format as sync_products.py)
-        tags = json.loads(product["tags"]) if product.get("tags") else []
-        combined = f"{product['name']} {product['description']} {product.get('category_name', '')} {' '.join(tags)}"
-        
-        # Generate embedding
-        embedding = embed_text(combined)
-        embeddings.append(embedding)
-        
-        # Weight by activity type: purchases = 2.0, views = 1.0
-        if product_id in activity['purchases']:
-            weights.append(2.0)
-        elif product_id in activity['views']:
-            weights.append(1.0)
-        else:
-            weights.append(0.5)  # Category fallback
+    exclude = list(exclude)
+    placeholders = ','.join(['%s'] * len(exclude)) if exclude else '0'
+    query = f"""
+        SELECT id FROM products
+        WHERE category_id = %s
+        AND id NOT IN ({placeholders})
+        ORDER BY id
+        LIMIT %s
+    """
+    params = [category_id] + exclude + [limit]
     
-    if not embeddings:
-        return None
+    with get_connection() as db:
+        cursor = db.cursor(dictionary=True)
+        try:
+            cursor.execute(query, params)
+            return [row['id'] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+
+def get_product_vectors(product_ids: List[int]) -> Dict[int, np.ndarray]:
+    """
+    Look up product embeddings, preferring the precomputed vector store.
     
-    # Weighted average of embeddings
-    embeddings_array = np.array(embeddings)
-    weights_array = np.array(weights)
-    weights_array = weights_array / weights_array.sum()  # Normalize weights
+    Products the store doesn't have yet (added after the last sync) are
+    fetched and embedded; ids missing from MySQL are left out.
     
-    # Calculate weighted average
-    user_vector = np.average(embeddings_array, axis=0, weights=weights_array)
+    Returns:
+        Dictionary mapping product_id -> vector
+    """
+    found_ids, stored_vectors = vector_store.get(product_ids)
+    vectors = dict(zip(found_ids, stored_vectors)) if found_ids else {}
+    
+    missing_ids = [pid for pid in product_ids if pid not in vectors]
+    if missing_ids:
+        products = fetch_products_batch(missing_ids)
+        missing_ids = [pid for pid in missing_ids if pid in products]
+        if missing_ids:
+            embedded = embed_batch([build_product_text(products[pid]) for pid in missing_ids])
+            vectors.update(zip(missing_ids, embedded))
+    
+    return vectors
+
+
+def profile_weight(product_id: int, purchased, viewed) -> float:
+    """
+    Weight of a product in the user profile: purchases = 2.0, views = 1.0,
+    category fallback = 0.5.
     
-    # Normalize the result
-    norm = np.linalg.norm(user_vector)
-    if norm > 0:
-        user_vector = user_vector / norm
+    The product's type comes from the user's whole history, not from the
+    slot it was selected for: an older purchase picked as a recent view
+    still counts as a purchase.
     
-    return user_vector
+    Args:
+        product_id: Product ID
+        purchased: Product ids the user has purchased
+        viewed: Product ids the user has viewed
+    """
+    if product_id in purchased:
+        return PURCHASE_WEIGHT
+    if product_id in viewed:
+        return VIEW_WEIGHT
+    return FALLBACK_WEIGHT
 
 
-def get_user_interacted_products(user_id: int) -> set:
+def get_user_interacted_products(user_id: int, activity: Optional[UserActivity] = None) -> set:
     """
     Get all product IDs the user has interacted with (purchases + views).
     
     Returns:
         Set of product IDs
     """
-    activity = fetch_user_activity(user_id)
-    interacted = set(activity['purchases']) | set(activity['views'])
-    return interacted
+    if activity is None:
+        activity = fetch_user_activity(user_id)
+    return activity.interacted
 
@@ -0,0 +1,275 @@
+# vector_store.py
+"""
+On-disk store of product embeddings, written by sync_products.
+
+Vectors live in a float32 .npy matrix that is memory-mapped on read, with
+a parallel .npy array of product ids giving the id -> row index. Each sync
+writes a new generation (storage.GenerationDir) and then atomically swaps
+the CURRENT pointer, so readers in other processes always see a complete
+matrix.
+
+Rows written by sync also carry the product's search payload (JSON lines
+with a row offset index, plus a category id array), which is what the
+in-process search backend serves results from. A generation only gets
+payload files when every row has one.
+"""
+import json
+import os
+import shutil
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from reranker import category_array
+from storage import GenerationDir
+
+VECTOR_STORE_DIR = os.getenv(
+    "VECTOR_STORE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "product_vectors")
+)
+
+
+@dataclass
+class Generation:
+    """One published store generation; rows of every array line up."""
+    index: Dict[int, int]                   # product id -> row
+    ids: np.ndarray
+    vectors: Optional[np.ndarray]           # memory-mapped (rows, dim) float32
+    payloads: Optional[np.ndarray] = None   # memory-mapped JSON lines (uint8)
+    offsets: Optional[np.ndarray] = None    # (rows + 1,) byte offsets into payloads
+    categories: Optional[np.ndarray] = None  # category id per row (NO_CATEGORY if unset)
+
+    def payload(self, row: int) -> dict:
+        return json.loads(self.payloads[self.offsets[row]:self.offsets[row + 1]].tobytes())
+
+
+EMPTY_GENERATION = Generation(index={}, ids=np.empty(0, dtype=np.int64), vectors=None)
+
+
+class ProductVectorStore:
+    """Memory-mapped product_id -> embedding lookup."""
+
+    def __init__(self, path: str = VECTOR_STORE_DIR):
+        self.path = path
+        self.generations = GenerationDir(path)
+        # Swapped as one object so readers never pair an index with the wrong matrix
+        self._state: Generation = EMPTY_GENERATION
+
+    def _files(self, generation: str) -> Tuple[str, str]:
+        return (
+            self.generations.file("ids", generation, ".npy"),
+            self.generations.file("vectors", generation, ".npy"),
+        )
+
+    def _payload_files(self, generation: str) -> Tuple[str, str, str]:
+        return (
+            self.generations.file("payloads", generation, ".jsonl"),
+            self.generations.file("offsets", generation, ".npy"),
+            self.generations.file("categories", generation, ".npy"),
+        )
+
+    def writer(self) -> "VectorStoreWriter":
+        """Start a new generation that rows can be streamed into."""
+        return VectorStoreWriter(self)
+
+    def _load(self, generation: str):
+        ids_file, vectors_file = self._files(generation)
+        ids = np.load(ids_file)
+        state = Generation(
+            index={int(pid): row for row, pid in enumerate(ids)},
+            ids=ids,
+            vectors=np.load(vectors_file, mmap_mode="r")
+        )
+
+        payloads_file, offsets_file, categories_file = self._payload_files(generation)
+        if os.path.exists(payloads_file):
+            size = os.path.getsize(payloads_file)
+            state.payloads = (
+                np.memmap(payloads_file, dtype=np.uint8, mode="r") if size else np.empty(0, dtype=np.uint8)
+            )
+            state.offsets = np.load(offsets_file)
+            state.categories = np.load(categories_file)
+        elif not os.path.exists(ids_file):
+            # Replaced and cleaned up while loading, not a generation without payloads
+            raise FileNotFoundError(payloads_file)
+
+        self._state = state
+
+    def _refresh(self):
+        self.generations.refresh(self._load)
+
+    def snapshot(self) -> Generation:
+        """The current generation (consistent even if a new one is published meanwhile)."""
+        self._refresh()
+        return self._state
+
+    def content_hashes(self) -> Optional[dict]:
+        """{product_id: content_hash} from the stored payloads, or None if there are none."""
+        state = self.snapshot()
+        if state.payloads is None:
+            return None
+        return {int(pid): state.payload(row).get("content_hash") for row, pid in enumerate(state.ids)}
+
+    def get(self, product_ids: List[int]) -> Tuple[List[int], Optional[np.ndarray]]:
+        """
+        Gather stored vectors for the given products.
+
+        Args:
+            product_ids: Product IDs to look up
+
+        Returns:
+            (found_ids, matrix) where matrix[i] is the vector of found_ids[i];
+            matrix is None when none of the ids are stored
+        """
+        state = self.snapshot()
+        found = [pid for pid in product_ids if pid in state.index]
+        if not found:
+            return [], None
+        rows = [state.index[pid] for pid in found]
+        return found, np.asarray(state.vectors[rows], dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.snapshot().index)
+
+
+def _json_default(value):
+    # MySQL DECIMAL columns (price) arrive as Decimal; stored as strings, like Qdrant payloads
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class VectorStoreWriter:
+    """
+    Streams rows of a new store generation to disk in constant memory.
+
+    Rows are appended to raw .part files; commit() wraps them in .npy files
+    (a chunked copy) and publishes the generation. Payloads are optional per
+    append; the generation keeps them only if every row had one.
+    """
+
+    COPY_CHUNK_ROWS = 8192
+
+    def __init__(self, store: ProductVectorStore):
+        self.store = store
+        self.generation = store.generations.start()
+        self.count = 0
+        self.dim = None
+        self.has_payloads = True
+        self._payload_bytes = 0
+        self._parts = {
+            name: store.generations.file(name, self.generation, ".part")
+            for name in ("ids", "vectors", "payloads", "offsets", "categories")
+        }
+        self._fhs = {name: open(part, "wb") for name, part in self._parts.items()}
+
+    def append(self, product_ids: Iterable[int], vectors: np.ndarray, payloads: Optional[List[dict]] = None):
+        lines = None
+        if payloads is not None:
+            lines = [
+                json.dumps(p, separators=(",", ":"), default=_json_default).encode("utf-8") + b"\n"
+                for p in payloads
+            ]
+            categories = category_array(p.get("category_id") for p in payloads)
+        self._append_rows(product_ids, vectors, lines, categories if lines is not None else None)
+
+    def _append_rows(self, product_ids: Iterable[int], vectors: np.ndarray,
+                     lines: Optional[List[bytes]], categories: Optional[np.ndarray]):
+        ids = np.asarray(list(product_ids), dtype=np.int64)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or len(ids) != len(vectors):
+            raise ValueError(f"Expected one vector per id, got {len(ids)} ids and shape {vectors.shape}")
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of dim {self.dim}, got {vectors.shape[1]}")
+        if lines is not None and len(lines) != len(ids):
+            raise ValueError(f"Expected one payload per id, got {len(ids)} ids and {len(lines)} payloads")
+
+        self._fhs["ids"].write(ids.tobytes())
+        self._fhs["vectors"].write(vectors.tobytes())
+        self.count += len(ids)
+
+        if lines is None:
+            self.has_payloads = False
+        if self.has_payloads:
+            sizes = np.array([len(line) for line in lines], dtype=np.int64)
+            self._fhs["offsets"].write((self._payload_bytes + np.cumsum(sizes) - sizes).tobytes())
+            self._fhs["payloads"].write(b"".join(lines))
+            self._fhs["categories"].write(np.asarray(categories, dtype=np.int64).tobytes())
+            self._payload_bytes += int(sizes.sum())
+
+    def _copy_existing(self, exclude: Set[int]):
+        current = self.store._state
+        if current.vectors is None:
+            return
+        keep = [(pid, row) for pid, row in current.index.items() if pid not in exclude]
+        for start in range(0, len(keep), self.COPY_CHUNK_ROWS):
+            chunk = keep[start:start + self.COPY_CHUNK_ROWS]
+            rows = [row for _, row in chunk]
+            lines = None
+            if current.payloads is not None:
+                lines = [current.payloads[current.offsets[r]:current.offsets[r + 1]].tobytes() for r in rows]
+            self._append_rows(
+                [pid for pid, _ in chunk], current.vectors[rows], lines,
+                current.categories[rows] if lines is not None else None
+            )
+
+    def _finalize(self, part: str, target: str, dtype: str, shape: tuple):
+        with open(target, "wb") as out, open(part, "rb") as src:
+            np.lib.format.write_array_header_1_0(out, {
+                "descr": np.dtype(dtype).str,
+                "fortran_order": False,
+                "shape": shape,
+            })
+            shutil.copyfileobj(src, out, 1 << 20)
+        os.remove(part)
+
+    def commit(self, keep_existing_except: Optional[Set[int]] = None):
+        """
+        Publish the generation.
+
+        Args:
+            keep_existing_except: If given, rows of the current generation are
+                carried over unless their id is in this set
+        """
+        if keep_existing_except is not None:
+            self.store._refresh()
+            self._copy_existing(keep_existing_except)
+
+        if self.has_payloads:
+            # Closing offset, so row r spans offsets[r]:offsets[r + 1]
+            self._fhs["offsets"].write(np.array([self._payload_bytes], dtype=np.int64).tobytes())
+        for fh in self._fhs.values():
+            fh.close()
+
+        dim = self.dim if self.dim is not None else 0
+        ids_file, vectors_file = self.store._files(self.generation)
+        self._finalize(self._parts["ids"], ids_file, "<i8", (self.count,))
+        self._finalize(self._parts["vectors"], vectors_file, "<f4", (self.count, dim))
+
+        payloads_file, offsets_file, categories_file = self.store._payload_files(self.generation)
+        if self.has_payloads:
+            os.replace(self._parts["payloads"], payloads_file)
+            self._finalize(self._parts["offsets"], offsets_file, "<i8", (self.count + 1,))
+            self._finalize(self._parts["categories"], categories_file, "<i8", (self.count,))
+        else:
+            self._remove_parts("payloads", "offsets", "categories")
+        self.store.generations.publish(self.generation)
+
+    def _remove_parts(self, *names: str):
+        for name in names:
+            try:
+                os.remove(self._parts[name])
+            except OSError:
+                pass
+
+    def abort(self):
+        for fh in self._fhs.values():
+            fh.close()
+        self.store.generations.abort(self.generation)
+
+
+store = ProductVectorStore()
@@ -25,6 +25,7 @@ public function visit(Request $request, $id)
             'created_at' => now(),
             'updated_at' => now(),
         ]);
+        $this->notifyAiService($user->id, $product->id, 'view');
         return response()->json(['ok' => true]);
     }
 
@@ -48,6 +49,32 @@ public function buy(Request $request, $id)
             'created_at' => now(),
             'updated_at' => now(),
         ]);
+        $this->notifyAiService($user->id, $product->id, 'purchase');
         return response()->json(['ok' => true]);
     }
+
+    /**
+     * Report a view/purchase to the AI service so it can update the user's
+     * profile vector and drop cached recommendations.
+     * Best effort: profiles are rebuilt from the DB and cached entries expire
+     * on their own, so failures are ignored.
+     */
+    private function notifyAiService($userId, $productId, $type)
+    {
+        $aiServiceUrl = env('AI_SERVICE_URL', 'http://127.0.0.1:8001');
+
+        $ch = curl_init("{$aiServiceUrl}/events/interaction");
+        curl_setopt($ch, CURLOPT_POST, true);
+        curl_setopt($ch, CURLOPT_HTTPHEADER, ['Content-Type: application/json']);
+        curl_setopt($ch, CURLOPT_POSTFIELDS, json_encode([
+            'user_id' => $userId,
+            'product_id' => $productId,
+            'type' => $type,
+        ]));
+        curl_setopt($ch, CURLOPT_RETURNTRANSFER, true);
+        curl_setopt($ch, CURLOPT_TIMEOUT_MS, 500);
+        curl_setopt($ch, CURLOPT_CONNECTTIMEOUT_MS, 200);
+        curl_exec($ch);
+        curl_close($ch);
+    }
 }